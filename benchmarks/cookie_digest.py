@@ -0,0 +1,47 @@
+"""Compare the remember cookie digest, which copies a pre-keyed HMAC, against
+keying a new HMAC for every call as Flask-Login did before.
+
+Run with ``python benchmarks/cookie_digest.py``.
+"""
+
+import hmac
+import timeit
+from hashlib import sha512
+
+from flask import Flask
+
+from flask_login.utils import _cookie_digest
+from flask_login.utils import _secret_key
+from flask_login.utils import decode_cookie
+from flask_login.utils import encode_cookie
+
+NUMBER = 100_000
+
+
+def _unkeyed_digest(payload, key=None):
+    key = _secret_key(key)
+
+    return hmac.new(key, payload.encode("utf-8"), sha512).hexdigest()
+
+
+def main():
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "benchmark secret key"
+
+    with app.test_request_context():
+        assert _cookie_digest("1234") == _unkeyed_digest("1234")
+        cookie = encode_cookie("1234")
+
+        results = {
+            "hmac.new per call": lambda: _unkeyed_digest("1234"),
+            "_cookie_digest": lambda: _cookie_digest("1234"),
+            "encode_cookie": lambda: encode_cookie("1234"),
+            "decode_cookie": lambda: decode_cookie(cookie),
+        }
+        for name, func in results.items():
+            seconds = min(timeit.repeat(func, number=NUMBER, repeat=5))
+            print(f"{name:20} {seconds / NUMBER * 1e6:8.3f} us/call")
+
+
+if __name__ == "__main__":
+    main()
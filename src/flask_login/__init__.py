@@ -1,3 +1,10 @@
+from .bulk import issue_cookies
+from .bulk import verify_cookies
+from .cache import BatchScheduler
+from .cache import CookieCache
+from .cache import LoaderDeadline
+from .cache import SingleFlight
+from .cache import UserCache
 from .config import COOKIE_DURATION
 from .config import COOKIE_HTTPONLY
 from .config import COOKIE_NAME
@@ -14,14 +21,19 @@ from .signals import session_protected
 from .signals import user_accessed
 from .signals import user_loaded_from_cookie
 from .signals import user_loaded_from_request
+from .signals import user_loader_timeout
 from .signals import user_logged_in
 from .signals import user_logged_out
 from .signals import user_login_confirmed
 from .signals import user_needs_refresh
 from .signals import user_unauthorized
 from .test_client import FlaskLoginClient
+from .tokens import MemoryTokenStore
+from .tokens import SQLiteTokenStore
+from .tokens import TokenStore
 from .utils import confirm_login
 from .utils import current_user
+from .utils import current_user_async
 from .utils import decode_cookie
 from .utils import encode_cookie
 from .utils import fresh_login_required
@@ -45,20 +57,32 @@ __all__ = [
     "REFRESH_MESSAGE",
     "REFRESH_MESSAGE_CATEGORY",
     "LoginManager",
+    "issue_cookies",
+    "verify_cookies",
+    "BatchScheduler",
+    "CookieCache",
+    "LoaderDeadline",
+    "SingleFlight",
+    "UserCache",
     "AnonymousUserMixin",
     "UserMixin",
     "session_protected",
     "user_accessed",
     "user_loaded_from_cookie",
     "user_loaded_from_request",
+    "user_loader_timeout",
     "user_logged_in",
     "user_logged_out",
     "user_login_confirmed",
     "user_needs_refresh",
     "user_unauthorized",
     "FlaskLoginClient",
+    "MemoryTokenStore",
+    "SQLiteTokenStore",
+    "TokenStore",
     "confirm_login",
     "current_user",
+    "current_user_async",
     "decode_cookie",
     "encode_cookie",
     "fresh_login_required",
@@ -0,0 +1,112 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from .utils import _cookie_settings
+from .utils import _decode_cookie
+from .utils import _encode_cookie
+
+
+def verify_cookies(cookies, key=None, chunk_size=1000, max_workers=None):
+    """Verify many remember cookies like `decode_cookie`, spread over a pool
+    of processes. Returns an iterator of ``(cookie, payload)`` tuples in the
+    order of `cookies`, with `payload` being ``None`` for cookies that fail
+    verification or have expired.
+
+    `cookies` is consumed lazily, `chunk_size` cookies at a time, and only a
+    few chunks per worker are in flight at once, so it may be a file or any
+    other iterator too large to fit in memory.
+
+    The keys, digest and format are taken from the app config when this is
+    called, so it must be called within an application context. The digests
+    in :attr:`LoginManager.cookie_digests` must be picklable, that is,
+    defined at the top level of a module. Opaque tokens from a
+    :attr:`LoginManager.token_store` are not supported.
+
+    :param cookies: The cookies to verify.
+    :param key: The key to verify with, like for `decode_cookie`.
+    :type key: str
+    :param chunk_size: The number of cookies sent to a worker at once.
+        Defaults to ``1000``.
+    :type chunk_size: int
+    :param max_workers: The number of worker processes. Defaults to the
+        number of CPUs. Set to ``0`` to verify in the current process.
+    :type max_workers: int
+    """
+    settings = _cookie_settings(key)
+    return _map_chunks(_verify_chunk, (settings,), cookies, chunk_size, max_workers)
+
+
+def issue_cookies(payloads, key=None, expires=None, chunk_size=1000, max_workers=None):
+    """Encode many payloads into remember cookies like `encode_cookie`,
+    spread over a pool of processes. Returns an iterator of
+    ``(payload, cookie)`` tuples in the order of `payloads`.
+
+    It works like :func:`verify_cookies`, and the same restrictions apply.
+
+    :param payloads: The values to encode, as `str`.
+    :param key: The key to sign with, like for `encode_cookie`.
+    :type key: str
+    :param expires: When the cookies expire, like for `encode_cookie`.
+    :type expires: :class:`datetime.datetime`
+    :param chunk_size: The number of payloads sent to a worker at once.
+        Defaults to ``1000``.
+    :type chunk_size: int
+    :param max_workers: The number of worker processes. Defaults to the
+        number of CPUs. Set to ``0`` to encode in the current process.
+    :type max_workers: int
+    """
+    if expires is not None:
+        expires = int(expires.timestamp())
+
+    settings = _cookie_settings(key)
+    return _map_chunks(
+        _issue_chunk, (settings, expires), payloads, chunk_size, max_workers
+    )
+
+
+def _verify_chunk(settings, cookies):
+    now = time.time()
+    payloads = []
+    for cookie in cookies:
+        payload, _, expires = _decode_cookie(cookie, settings)
+        if expires is not None and expires <= now:
+            payload = None
+        payloads.append(payload)
+    return payloads
+
+
+def _issue_chunk(settings, expires, payloads):
+    return [_encode_cookie(payload, settings, expires) for payload in payloads]
+
+
+def _chunked(items, size):
+    items = iter(items)
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _map_chunks(func, args, items, chunk_size, max_workers):
+    if max_workers == 0:
+        for chunk in _chunked(items, chunk_size):
+            yield from zip(chunk, func(*args, chunk))
+        return
+
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(workers) as executor:
+        # bound the chunks in flight, so results stream out as input streams in
+        pending = deque()
+        for chunk in _chunked(items, chunk_size):
+            pending.append((chunk, executor.submit(func, *args, chunk)))
+            if len(pending) >= 2 * workers:
+                chunk, future = pending.popleft()
+                yield from zip(chunk, future.result())
+
+        while pending:
+            chunk, future = pending.popleft()
+            yield from zip(chunk, future.result())
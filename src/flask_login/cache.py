@@ -0,0 +1,522 @@
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+#: Returned by :meth:`UserCache.get` when nothing is cached for an ID.
+_MISSING = object()
+
+
+def _seconds(value):
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    return value
+
+
+class _LRUStore:
+    """An ordered mapping with a per-entry expiry time, evicting the least
+    recently used entry once `maxsize` entries are stored. Entries are
+    returned as stale for another `grace` seconds after they expire. Expired
+    entries are not removed until they are evicted or replaced, so they can
+    still be read with :meth:`peek`. Not thread-safe on its own;
+    :class:`UserCache` guards it with a lock.
+    """
+
+    def __init__(self, maxsize, ttl, timer, grace=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.grace = grace
+        self._timer = timer
+        self._data = OrderedDict()
+
+    def lookup(self, key):
+        """Return ``(value, stale)`` for `key`, or ``None`` if it is not
+        stored or past its grace period.
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+
+        expires, value = entry
+        now = self._timer()
+        if expires + self.grace <= now:
+            return None
+
+        self._data.move_to_end(key)
+        return value, expires <= now
+
+    def peek(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        return entry[1]
+
+    def get(self, key, default=None):
+        found = self.lookup(key)
+        if found is None or found[1]:
+            return default
+        return found[0]
+
+    def set(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        self._data[key] = (self._timer() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        self._data.pop(key, None)
+
+    def prune(self, predicate):
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserCache:
+    """A bounded, per-process cache of user objects that sits in front of the
+    :meth:`LoginManager.user_loader` callback. Entries expire after `ttl`
+    seconds, and once `maxsize` entries are stored the least recently used
+    one is evicted.
+
+    To enable it, assign an instance to :attr:`LoginManager.user_cache`::
+
+        login_manager.user_cache = UserCache(maxsize=10000, ttl=60)
+
+    IDs for which the callback returned ``None`` (deleted or banned users
+    whose clients keep sending a session or remember cookie) can be cached as
+    well, by setting `negative_maxsize`. These misses are kept in a separate
+    LRU with its own, usually much shorter, `negative_ttl`.
+
+    With `stale_ttl`, users are kept for that much longer after `ttl` has
+    passed. A request asking for such a stale user gets it right away, while
+    the user is reloaded on one of `refresh_workers` background threads.
+    Only once `stale_ttl` has passed as well does a request have to wait for
+    the loader again.
+
+    Cached entries are dropped automatically by :func:`login_user` and
+    :func:`logout_user`. If a user changes in some other way (e.g. their
+    account is deactivated), call :meth:`LoginManager.invalidate`.
+
+    :param maxsize: The maximum number of users to keep. Defaults to ``1024``.
+    :type maxsize: int
+    :param ttl: How long a user is cached for, as a `datetime.timedelta` or
+        number of seconds. Defaults to 5 minutes.
+    :type ttl: :class:`datetime.timedelta`
+    :param negative_maxsize: The maximum number of unknown IDs to remember.
+        Defaults to ``0``, which disables negative caching.
+    :type negative_maxsize: int
+    :param negative_ttl: How long an unknown ID is remembered for, as a
+        `datetime.timedelta` or number of seconds. Defaults to 30 seconds.
+    :type negative_ttl: :class:`datetime.timedelta`
+    :param stale_ttl: How long a user may be served stale after `ttl` has
+        passed, as a `datetime.timedelta` or number of seconds. Defaults to
+        ``0``, which disables background refreshes.
+    :type stale_ttl: :class:`datetime.timedelta`
+    :param refresh_workers: The number of threads refreshing stale users.
+        Defaults to ``2``.
+    :type refresh_workers: int
+    """
+
+    def __init__(
+        self,
+        maxsize=1024,
+        ttl=300,
+        negative_maxsize=0,
+        negative_ttl=30,
+        stale_ttl=0,
+        refresh_workers=2,
+        timer=time.monotonic,
+    ):
+        self._users = _LRUStore(maxsize, _seconds(ttl), timer, _seconds(stale_ttl))
+        self._misses = _LRUStore(negative_maxsize, _seconds(negative_ttl), timer)
+        self._lock = threading.Lock()
+        self._refresh_workers = refresh_workers
+        self._executor = None
+        self._refreshing = {}
+
+    @property
+    def maxsize(self):
+        return self._users.maxsize
+
+    @property
+    def ttl(self):
+        return self._users.ttl
+
+    @property
+    def stale_ttl(self):
+        return self._users.grace
+
+    def get(self, user_id, default=None, refresh=None):
+        """Return the cached user for `user_id`. If `user_id` is a cached
+        miss, ``None`` is returned; if it is not cached at all (or has
+        expired), `default` is returned.
+
+        If the user is stale and `refresh` is given, the stale user is
+        returned and `refresh` is called on a background thread to load the
+        user again. Without `refresh`, stale users are treated as expired.
+        """
+        key = str(user_id)
+        with self._lock:
+            found = self._users.lookup(key)
+            if found is not None:
+                user, stale = found
+                if not stale:
+                    return user
+                if refresh is not None:
+                    self._schedule_refresh(key, refresh)
+                    return user
+
+            if self._misses.get(key) is not None:
+                return None
+
+            return default
+
+    def peek(self, user_id):
+        """Return the last user cached for `user_id`, even if it has expired,
+        or ``None`` if it was evicted or never cached.
+        """
+        with self._lock:
+            return self._users.peek(str(user_id))
+
+    def _schedule_refresh(self, key, refresh):
+        if key in self._refreshing:
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                self._refresh_workers, thread_name_prefix="flask-login-refresh"
+            )
+
+        token = self._refreshing[key] = object()
+        self._executor.submit(self._refresh, key, token, refresh)
+
+    def _refresh(self, key, token, refresh):
+        user = _MISSING
+        try:
+            user = refresh()
+        finally:
+            with self._lock:
+                # skip the result if invalidate() was called while refreshing
+                if self._refreshing.get(key) is token:
+                    del self._refreshing[key]
+                    if user is not _MISSING:
+                        self._set_locked(key, user)
+
+    def set(self, user_id, user):
+        """Cache `user` under `user_id`, evicting the least recently used
+        entry if the cache is full. If `user` is ``None``, `user_id` is
+        recorded as a miss instead.
+        """
+        with self._lock:
+            self._set_locked(str(user_id), user)
+
+    def _set_locked(self, key, user):
+        if user is None:
+            self._users.pop(key)
+            self._misses.set(key, True)
+        else:
+            self._misses.pop(key)
+            self._users.set(key, user)
+
+    def invalidate(self, user_id):
+        """Drop `user_id` from the cache, if present."""
+        key = str(user_id)
+        with self._lock:
+            self._users.pop(key)
+            self._misses.pop(key)
+            self._refreshing.pop(key, None)
+
+    def clear(self):
+        """Drop every cached user and miss."""
+        with self._lock:
+            self._users.clear()
+            self._misses.clear()
+            self._refreshing.clear()
+
+    def __len__(self):
+        return len(self._users)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+
+class CookieCache:
+    """A bounded, per-process LRU of remember cookies that passed
+    verification, mapping each cookie to its payload, so a cookie sent again
+    and again is not verified again on every request.
+
+    To enable it, assign an instance to :attr:`LoginManager.cookie_cache`::
+
+        login_manager.cookie_cache = CookieCache(maxsize=10000)
+
+    Entries are only valid for the app, secret keys, digest and format they
+    were verified with. When any of these change for an app, its entries are
+    flushed. Cookies that fail verification are never cached, so forged
+    cookies cannot push out valid ones.
+
+    :param maxsize: The maximum number of cookies to keep. Defaults to
+        ``4096``.
+    :type maxsize: int
+    """
+
+    def __init__(self, maxsize=4096):
+        self._cookies = _LRUStore(maxsize, math.inf, time.monotonic)
+        self._contexts = {}
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self):
+        return self._cookies.maxsize
+
+    def get(self, context, cookie, namespace=None):
+        """Return what was cached for `cookie` under `context` in
+        `namespace`, or ``None``. If `context` differs from the one entries
+        of `namespace` were cached under, they are flushed first.
+        """
+        with self._lock:
+            if self._contexts.get(namespace, _MISSING) != context:
+                self._flush(namespace)
+                self._contexts[namespace] = context
+                return None
+            return self._cookies.get((namespace, cookie))
+
+    def set(self, context, cookie, result, namespace=None):
+        """Cache `result` for `cookie` in `namespace`, if `context` is still
+        current.
+        """
+        with self._lock:
+            if self._contexts.get(namespace, _MISSING) == context:
+                self._cookies.set((namespace, cookie), result)
+
+    def _flush(self, namespace):
+        if self._contexts.keys() <= {namespace}:
+            self._cookies.clear()
+        else:
+            self._cookies.prune(lambda key: key[0] == namespace)
+
+    def clear(self):
+        """Drop every cached cookie."""
+        with self._lock:
+            self._cookies.clear()
+            self._contexts.clear()
+
+    def __len__(self):
+        return len(self._cookies)
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces concurrent calls for the same key, so that while one thread
+    is loading a user, other threads asking for the same ID wait for that
+    call and share its result instead of calling the loader themselves.
+
+    To enable it, assign an instance to :attr:`LoginManager.single_flight`::
+
+        login_manager.single_flight = SingleFlight(timeout=2)
+
+    Since the same user object is handed to several threads, this should only
+    be used with loaders returning objects that are safe to share, just like
+    :class:`UserCache`.
+
+    :param timeout: How long to wait for another thread's call, as a
+        `datetime.timedelta` or number of seconds. If it takes longer, the
+        waiting thread calls the loader itself. Defaults to ``None``, which
+        waits indefinitely.
+    :type timeout: :class:`datetime.timedelta`
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = _seconds(timeout)
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args):
+        """Call ``func(*args)``, unless a call for `key` is already in flight,
+        in which case its result is returned (or its exception raised).
+        """
+        key = str(key)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if leader:
+            try:
+                call.result = func(*args)
+            except BaseException as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+
+        if not call.done.wait(self.timeout):
+            return func(*args)
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+class _Batch:
+    __slots__ = ("keys", "full", "done", "results", "error")
+
+    def __init__(self):
+        self.keys = {}
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.results = None
+        self.error = None
+
+
+class BatchScheduler:
+    """Collects user loads from concurrent threads over a short window and
+    dispatches them as a single call to the
+    :meth:`LoginManager.user_batch_loader` callback, in the style of a
+    dataloader. The first thread to ask for a user opens a batch, waits up to
+    `window` seconds (or until `max_batch` distinct IDs are queued), then
+    calls the batch loader and hands each waiting thread its user.
+
+    To enable it, register a batch loader and assign an instance to
+    :attr:`LoginManager.batch_scheduler`::
+
+        login_manager.batch_scheduler = BatchScheduler(window=0.002)
+
+    Every load pays up to `window` seconds of extra latency, in exchange for
+    turning many point lookups into one query. The batch loader runs in the
+    thread (and application context) that opened the batch, and the user
+    objects it returns are handed to other threads, so they should be safe to
+    share, just like with :class:`UserCache`.
+
+    :param window: How long to collect IDs for, as a `datetime.timedelta` or
+        number of seconds. Defaults to 2 milliseconds.
+    :type window: :class:`datetime.timedelta`
+    :param max_batch: Dispatch a batch early once it holds this many IDs.
+        Defaults to ``100``.
+    :type max_batch: int
+    """
+
+    def __init__(self, window=0.002, max_batch=100):
+        self.window = _seconds(window)
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._batches = {}
+
+    def load(self, key, func, group=None):
+        """Queue `key` in the open batch of `group` (opening one if needed),
+        wait for it to be dispatched and return the result for `key`. `func`
+        is called with the list of queued keys, and must return a dict mapping
+        them to their results. Keys of different groups, e.g. of different
+        apps, are never batched together.
+        """
+        key = str(key)
+        with self._lock:
+            batch = self._batches.get(group)
+            leader = batch is None
+            if leader:
+                batch = self._batches[group] = _Batch()
+            batch.keys[key] = None
+            if len(batch.keys) >= self.max_batch:
+                del self._batches[group]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._batches.get(group) is batch:
+                    del self._batches[group]
+            try:
+                batch.results = func(list(batch.keys))
+            except BaseException as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return batch.results.get(key)
+
+
+class LoaderDeadline:
+    """Runs :meth:`LoginManager.user_loader` and
+    :meth:`LoginManager.request_loader` callbacks on a pool of worker threads,
+    and stops waiting for them after `timeout` seconds, so that a degraded
+    user database cannot hang every request thread.
+
+    To enable it, assign an instance to :attr:`LoginManager.loader_deadline`::
+
+        login_manager.loader_deadline = LoaderDeadline(timeout=0.5)
+
+    When a callback misses the deadline, :data:`user_loader_timeout` is sent
+    and `fallback` decides what happens to the request:
+
+    - ``"anonymous"`` treats the request as anonymous.
+    - ``"stale"`` uses the last user in :attr:`LoginManager.user_cache`, even
+      if it has expired, and treats the request as anonymous if there is
+      none.
+    - ``"abort"`` aborts the request with a 503 (Service Unavailable) error.
+
+    The callback keeps running on its worker until it returns, so at most
+    `max_workers` slow calls are in progress at once; further calls wait for
+    a free worker, counting against their own deadline.
+
+    :param timeout: How long to wait for a callback, as a `datetime.timedelta`
+        or number of seconds.
+    :type timeout: :class:`datetime.timedelta`
+    :param fallback: One of ``"anonymous"`` (the default), ``"stale"`` or
+        ``"abort"``.
+    :type fallback: str
+    :param max_workers: The number of worker threads. Defaults to ``8``.
+    :type max_workers: int
+    """
+
+    def __init__(self, timeout, fallback="anonymous", max_workers=8):
+        if fallback not in ("anonymous", "stale", "abort"):
+            raise ValueError(f"Unknown loader deadline fallback: {fallback!r}")
+
+        self.timeout = _seconds(timeout)
+        self.fallback = fallback
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="flask-login-loader"
+        )
+
+    def call(self, func, *args):
+        """Call ``func(*args)`` on a worker thread, within a copy of the
+        caller's context (and therefore its Flask application and request
+        context). Raises :class:`concurrent.futures.TimeoutError` if it does
+        not return within `timeout` seconds.
+        """
+        future = self._submit(func, *args)
+        try:
+            return future.result(self.timeout)
+        except BaseException:
+            future.cancel()
+            raise
+
+    def _submit(self, func, *args):
+        context = contextvars.copy_context()
+        return self._executor.submit(context.run, func, *args)
@@ -0,0 +1,84 @@
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import click
+from flask.cli import AppGroup
+
+from .bulk import issue_cookies
+from .bulk import verify_cookies
+
+#: The ``flask login`` command group, added to the app by
+#: :meth:`LoginManager.init_app`.
+cli = AppGroup("login", help="Work with Flask-Login remember cookies.")
+
+_chunk_size = click.option(
+    "--chunk-size",
+    default=1000,
+    show_default=True,
+    help="Number of lines sent to a worker at once.",
+)
+_workers = click.option(
+    "--workers",
+    type=int,
+    default=None,
+    help="Number of worker processes. Defaults to the number of CPUs; 0 runs"
+    " in the current process.",
+)
+
+
+def _lines(file):
+    for line in file:
+        yield line.rstrip("\r\n")
+
+
+@cli.command("verify-cookies")
+@click.argument("input", type=click.File("r"))
+@click.option("-o", "--output", type=click.File("w"), default="-")
+@_chunk_size
+@_workers
+def verify_cookies_command(input, output, chunk_size, workers):
+    """Verify the remember cookies in INPUT, one per line.
+
+    Writes a line per cookie, in order: "valid", a tab and the payload, or
+    "invalid". Use "-" to read from standard input.
+    """
+    valid = invalid = 0
+    results = verify_cookies(_lines(input), chunk_size=chunk_size, max_workers=workers)
+    for _, payload in results:
+        if payload is None:
+            invalid += 1
+            output.write("invalid\n")
+        else:
+            valid += 1
+            output.write(f"valid\t{payload}\n")
+
+    click.echo(f"{valid} valid, {invalid} invalid", err=True)
+
+
+@cli.command("issue-cookies")
+@click.argument("input", type=click.File("r"))
+@click.option("-o", "--output", type=click.File("w"), default="-")
+@click.option(
+    "--expires-in",
+    type=int,
+    default=None,
+    help="Sign an expiry time this many seconds from now into the cookies.",
+)
+@_chunk_size
+@_workers
+def issue_cookies_command(input, output, expires_in, chunk_size, workers):
+    """Issue remember cookies for the payloads (usually user IDs) in INPUT,
+    one per line.
+
+    Writes a cookie per line, in order. Use "-" to read from standard input.
+    """
+    expires = None
+    if expires_in is not None:
+        expires = datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+
+    results = issue_cookies(
+        _lines(input), expires=expires, chunk_size=chunk_size, max_workers=workers
+    )
+    for _, cookie in results:
+        output.write(f"{cookie}\n")
@@ -8,6 +8,24 @@ COOKIE_NAME = "remember_token"
 # "remember me" cookie 过期之前的默认时间 (365 天)。
 COOKIE_DURATION = timedelta(days=365)
 
+#: The default digest the "remember me" cookie is signed with (HMAC-SHA512)
+# "remember me" cookie 签名所用的默认摘要算法 (HMAC-SHA512)。
+COOKIE_DIGEST = "sha512"
+
+#: The default format of the "remember me" cookie, ``"text"`` or ``"compact"``
+# "remember me" cookie 的默认格式，``"text"`` 或 ``"compact"``。
+COOKIE_FORMAT = "text"
+
+#: The default length in bytes of the MAC in compact "remember me" cookies
+# 紧凑格式 "remember me" cookie 中 MAC 的默认长度（字节）。
+COOKIE_MAC_SIZE = 16
+
+#: Whether the expiry time of the "remember me" cookie is signed into it, so
+#: it is enforced on the server as well; defaults to ``False``
+# 是否将 "remember me" cookie 的过期时间签入 cookie 中，以便在服务器端也强制执行；
+# 默认为 ``False``。
+COOKIE_SIGN_EXPIRY = False
+
 #: Whether the "remember me" cookie requires Secure; defaults to ``False``
 # "remember me" cookie 是否需要 Secure 属性；默认为 ``False``。
 COOKIE_SECURE = False
@@ -41,13 +59,19 @@ REFRESH_MESSAGE_CATEGORY = "message"
 # 用于获取用户 str id 的默认属性。
 ID_ATTRIBUTE = "get_id"
 
+#: The default fingerprint the session identifier is made with (SHA-512)
+# 生成会话标识符所用的默认指纹算法 (SHA-512)。
+SESSION_FINGERPRINT = "sha512"
+
 #: A set of session keys that are populated by Flask-Login. Use this set to
 #: purge keys safely and accurately.
 # 由 Flask-Login 填充的一组 session 键。使用此集合可以安全、准确地清除键。
 SESSION_KEYS = {
     "_user_id",
+    "_user_snapshot",
     "_remember",
     "_remember_seconds",
+    "_remember_expires",
     "_id",
     "_fresh",
     "next",
@@ -70,4 +94,130 @@ EXEMPT_METHODS = {"OPTIONS"}
 #: rather than a url parameter when redirecting to the login view; defaults to
 #: ``False``.
 # 如果为 True，当重定向到登录视图时，用户试图访问的页面会存储在 session 中，而不是作为 URL 参数；默认为 ``False``。
-USE_SESSION_FOR_NEXT = False
\ No newline at end of file
+USE_SESSION_FOR_NEXT = False
+
+#: The default time a user snapshot stored in the session is trusted for,
+#: before the user is loaded through the ``user_loader`` again (5 minutes).
+# 存储在 session 中的用户快照在通过 ``user_loader`` 重新加载用户之前的默认可信时间 (5 分钟)。
+SNAPSHOT_MAX_AGE = timedelta(minutes=5)
+
+
+class _LoginConfig:
+    """A read-only snapshot of the Flask-Login settings in an app config, with
+    the defaults above filled in and durations normalized to
+    :class:`~datetime.timedelta`. Invalid settings raise when it is built.
+    """
+
+    __slots__ = (
+        "cookie_name",
+        "cookie_domain",
+        "cookie_path",
+        "cookie_secure",
+        "cookie_httponly",
+        "cookie_samesite",
+        "cookie_duration",
+        "cookie_refresh_each_request",
+        "cookie_refresh_threshold",
+        "cookie_sign_expiry",
+        "cookie_digest",
+        "cookie_format",
+        "cookie_mac_size",
+        "session_fingerprint",
+        "use_session_for_next",
+        "snapshot_max_age",
+    )
+
+    def __init__(self, config):
+        cookie_format = config.get("REMEMBER_COOKIE_FORMAT", COOKIE_FORMAT)
+        if cookie_format not in ("text", "compact"):
+            raise Exception(
+                "REMEMBER_COOKIE_FORMAT must be 'text' or 'compact',"
+                f" instead got: {cookie_format}"
+            )
+
+        mac_size = config.get("REMEMBER_COOKIE_MAC_SIZE", COOKIE_MAC_SIZE)
+        if not isinstance(mac_size, int) or not 8 <= mac_size <= 32:
+            raise Exception(
+                "REMEMBER_COOKIE_MAC_SIZE must be an integer from 8 to 32,"
+                f" instead got: {mac_size}"
+            )
+
+        set_value = object.__setattr__
+        set_value(self, "cookie_name", config.get("REMEMBER_COOKIE_NAME", COOKIE_NAME))
+        set_value(self, "cookie_domain", config.get("REMEMBER_COOKIE_DOMAIN"))
+        set_value(self, "cookie_path", config.get("REMEMBER_COOKIE_PATH", "/"))
+        set_value(
+            self, "cookie_secure", config.get("REMEMBER_COOKIE_SECURE", COOKIE_SECURE)
+        )
+        set_value(
+            self,
+            "cookie_httponly",
+            config.get("REMEMBER_COOKIE_HTTPONLY", COOKIE_HTTPONLY),
+        )
+        set_value(
+            self,
+            "cookie_samesite",
+            config.get("REMEMBER_COOKIE_SAMESITE", COOKIE_SAMESITE),
+        )
+        set_value(
+            self,
+            "cookie_duration",
+            _duration(config, "REMEMBER_COOKIE_DURATION", COOKIE_DURATION),
+        )
+        set_value(
+            self,
+            "cookie_refresh_each_request",
+            bool(config.get("REMEMBER_COOKIE_REFRESH_EACH_REQUEST")),
+        )
+        set_value(
+            self,
+            "cookie_refresh_threshold",
+            _duration(config, "REMEMBER_COOKIE_REFRESH_THRESHOLD", None),
+        )
+        set_value(
+            self,
+            "cookie_sign_expiry",
+            bool(config.get("REMEMBER_COOKIE_SIGN_EXPIRY", COOKIE_SIGN_EXPIRY)),
+        )
+        set_value(
+            self, "cookie_digest", config.get("REMEMBER_COOKIE_DIGEST", COOKIE_DIGEST)
+        )
+        set_value(self, "cookie_format", cookie_format)
+        set_value(self, "cookie_mac_size", mac_size)
+        set_value(
+            self,
+            "session_fingerprint",
+            config.get("SESSION_FINGERPRINT", SESSION_FINGERPRINT),
+        )
+        set_value(
+            self,
+            "use_session_for_next",
+            bool(config.get("USE_SESSION_FOR_NEXT", USE_SESSION_FOR_NEXT)),
+        )
+        set_value(
+            self,
+            "snapshot_max_age",
+            _duration(config, "USER_SNAPSHOT_MAX_AGE", SNAPSHOT_MAX_AGE),
+        )
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is read-only")
+
+    def __repr__(self):
+        values = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({values})"
+
+
+def _duration(config, name, default):
+    """Return the config value `name` as a :class:`~datetime.timedelta`,
+    accepting a number of seconds as well.
+    """
+    value = config.get(name, default)
+    if value is None or isinstance(value, timedelta):
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return timedelta(seconds=value)
+    raise Exception(f"{name} must be a datetime.timedelta, instead got: {value}")
@@ -1,3 +1,11 @@
+import asyncio
+import inspect
+import itertools
+import secrets
+import threading
+import time
+import weakref
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
@@ -6,36 +14,42 @@ from flask import abort
 from flask import current_app
 from flask import flash
 from flask import g
+from flask import has_app_context
 from flask import redirect
 from flask import request
 from flask import session
 
-from .config import COOKIE_DURATION
-from .config import COOKIE_HTTPONLY
-from .config import COOKIE_NAME
-from .config import COOKIE_SAMESITE
-from .config import COOKIE_SECURE
+from .cache import _MISSING
+from .cache import CookieCache
+from .cli import cli
+from .config import _LoginConfig
 from .config import ID_ATTRIBUTE
 from .config import LOGIN_MESSAGE
 from .config import LOGIN_MESSAGE_CATEGORY
 from .config import REFRESH_MESSAGE
 from .config import REFRESH_MESSAGE_CATEGORY
 from .config import SESSION_KEYS
-from .config import USE_SESSION_FOR_NEXT
 from .mixins import AnonymousUserMixin
 from .signals import session_protected
 from .signals import user_accessed
 from .signals import user_loaded_from_cookie
 from .signals import user_loaded_from_request
+from .signals import user_loader_timeout
 from .signals import user_needs_refresh
 from .signals import user_unauthorized
+from .utils import _build_cookie_settings
+from .utils import _cookie_is_outdated
 from .utils import _create_identifier
+from .utils import _encode_cookie
+from .utils import _identifier_matches
 from .utils import _user_context_processor
-from .utils import decode_cookie
+from .utils import _verify_cookie
+from .utils import COOKIE_DIGESTS
 from .utils import encode_cookie
 from .utils import expand_login_view
 from .utils import login_url as make_login_url
 from .utils import make_next_param
+from .utils import SESSION_FINGERPRINTS
 
 
 class LoginManager:
@@ -98,15 +112,89 @@ class LoginManager:
 
         self._request_callback = None
 
+        self._user_batch_callback = None
+
+        self._snapshot_dumper = None
+
+        self._snapshot_loader = None
+
+        #: The generation of user snapshots. Snapshots stored in sessions with
+        #: a different generation are ignored, so incrementing this forces
+        #: every user to be loaded through the :meth:`user_loader` again.
+        self.snapshot_generation = 0
+
         self._session_identifier_generator = _create_identifier
 
+        #: An optional :class:`UserCache` which is consulted before calling the
+        #: :meth:`user_loader` callback. Set to ``None`` (the default) to call
+        #: the callback on every request.
+        self.user_cache = None
+
+        #: An optional :class:`CookieCache` remembering which remember
+        #: cookies were verified already. Set to ``None`` (the default) to
+        #: verify the cookie every time.
+        self.cookie_cache = None
+
+        #: An optional :class:`TokenStore`. If set, the "remember me" cookie
+        #: holds a random token looked up in the store, instead of the signed
+        #: user ID, so it can be revoked per device.
+        self.token_store = None
+
+        #: The fingerprints the session identifier can be made with, by name.
+        #: The one used for new sessions is chosen with
+        #: ``SESSION_FINGERPRINT``; sessions identified with any of the others
+        #: are still accepted. A fingerprint is a function taking the remote
+        #: address and user agent as ``bytes``, and returning a ``str``.
+        self.session_fingerprints = dict(SESSION_FINGERPRINTS)
+
+        self._app_states = weakref.WeakKeyDictionary()
+        self._app_numbers = itertools.count()
+        self._app_states_lock = threading.Lock()
+
+        #: An optional :class:`SingleFlight` which coalesces concurrent
+        #: :meth:`user_loader` calls for the same ID within this process.
+        self.single_flight = None
+
+        #: An optional :class:`BatchScheduler` which groups concurrent
+        #: :meth:`user_loader` calls into :meth:`user_batch_loader` calls.
+        #: It is only used if a batch loader is registered.
+        self.batch_scheduler = None
+
+        #: An optional :class:`LoaderDeadline` which bounds how long a request
+        #: waits for the :meth:`user_loader` and :meth:`request_loader`
+        #: callbacks.
+        self.loader_deadline = None
+
+        #: The digests remember cookies can be signed with, by name. The one
+        #: used for new cookies is chosen with ``REMEMBER_COOKIE_DIGEST``;
+        #: cookies signed with any of the others are still accepted, and
+        #: re-issued. A digest is a function taking the cookie payload and
+        #: the key, and returning the digest as a URL-safe ``str`` without
+        #: ``"."`` or ``"|"``.
+        self.cookie_digests = dict(COOKIE_DIGESTS)
+
+        #: If ``True``, a user restored from the session is not loaded right
+        #: away. Instead, `current_user` answers ``is_authenticated``,
+        #: ``is_anonymous`` and ``get_id()`` from the session, and the
+        #: :meth:`user_loader` callback is only called the first time any
+        #: other attribute is accessed. `login_required` then accepts users
+        #: the callback would return ``None`` for. Defaults to ``False``.
+        self.lazy_user = False
+
         if app is not None:
             self.init_app(app, add_context_processor)
 
     def init_app(self, app, add_context_processor=True):
         """
-        Configures an application. This registers an `after_request` call, and
-        attaches this `LoginManager` to it as `app.login_manager`.
+        Configures an application. This registers an `after_request` call and
+        the ``flask login`` commands, and attaches this `LoginManager` to it as
+        `app.login_manager`.
+
+        A `LoginManager` may be set up with any number of apps, e.g. tenants
+        behind :class:`~werkzeug.middleware.dispatcher.DispatcherMiddleware`.
+        It keeps what it derives from each app's config apart, and the users
+        of each app apart in :attr:`user_cache`, :attr:`cookie_cache`,
+        :attr:`single_flight` and :attr:`batch_scheduler`.
 
         :param app: The :class:`flask.Flask` object to configure.
         :type app: :class:`flask.Flask`
@@ -116,7 +204,12 @@ class LoginManager:
         :type add_context_processor: bool
         """
         app.login_manager = self
+        # fail now on a bad config, but build the snapshot kept for requests
+        # once the app is set up, as config is often changed after this
+        self._app_state(app).reset()
+        self._read_config(app.config)
         app.after_request(self._update_remember_cookie)
+        app.cli.add_command(cli)
 
         if add_context_processor:
             app.context_processor(_user_context_processor)
@@ -168,10 +261,9 @@ class LoginManager:
             else:
                 flash(self.login_message, category=self.login_message_category)
 
-        config = current_app.config
-        if config.get("USE_SESSION_FOR_NEXT", USE_SESSION_FOR_NEXT):
+        if self._config().use_session_for_next:
             login_url = expand_login_view(login_view)
-            session["_id"] = self._session_identifier_generator()
+            session["_id"] = self._session_identifier()
             session["next"] = make_next_param(login_url, request.url)
             redirect_url = make_login_url(login_view)
         else:
@@ -185,6 +277,10 @@ class LoginManager:
         function you set should take a user ID (a ``str``) and return a
         user object, or ``None`` if the user does not exist.
 
+        The callback may be an ``async def`` function. It is awaited directly
+        by :func:`current_user_async` and :meth:`load_user_async`, and run
+        through :meth:`flask.Flask.ensure_sync` everywhere else.
+
         :param callback: The callback for retrieving a user object.
         :type callback: callable
         """
@@ -196,12 +292,129 @@ class LoginManager:
         """Gets the user_loader callback set by user_loader decorator."""
         return self._user_callback
 
+    def user_batch_loader(self, callback):
+        """
+        This sets the callback for loading several users at once, used by
+        :meth:`load_users`. The function you set should take a list of user
+        IDs (as ``str``) and return a dict mapping those IDs to user objects.
+        IDs missing from the dict are treated as users that do not exist.
+
+        :param callback: The callback for retrieving several user objects.
+        :type callback: callable
+        """
+        self._user_batch_callback = callback
+        return self.user_batch_callback
+
+    @property
+    def user_batch_callback(self):
+        """Gets the user_batch_loader callback set by user_batch_loader
+        decorator."""
+        return self._user_batch_callback
+
+    def load_users(self, user_ids):
+        """
+        Loads several users at once, and returns a dict mapping each of the
+        given IDs to its user object, or ``None`` if the user does not exist.
+
+        Users found in :attr:`user_cache` are returned from there, and the
+        rest are fetched with a single call to the :meth:`user_batch_loader`
+        callback and cached. If no batch loader is registered, the
+        :meth:`user_loader` callback is called for each ID instead.
+
+        The :attr:`loader_deadline` applies to the batch loader call as a
+        whole, or to each :meth:`user_loader` call. Users whose load misses
+        it are ``None``, or with the ``"stale"`` fallback, the last cached
+        user if there is one.
+
+        This must be called within an application context.
+
+        :param user_ids: The IDs of the users to load.
+        :type user_ids: iterable
+        """
+        if self._user_batch_callback is None:
+            users = {}
+            for user_id in user_ids:
+                try:
+                    users[user_id] = self._load_user_by_id(user_id)
+                except _LoaderTimedOut:
+                    users[user_id] = None
+            return users
+
+        users = {}
+        missing = {}
+        cache = self.user_cache
+        state = self._app_state()
+        for user_id in user_ids:
+            user = _MISSING
+            if cache is not None:
+                user = cache.get(state.cache_key(user_id), _MISSING)
+            if user is _MISSING:
+                missing.setdefault(str(user_id), []).append(user_id)
+            else:
+                users[user_id] = user
+
+        if missing:
+            deadline = self.loader_deadline
+            try:
+                if deadline is None:
+                    loaded = self._load_user_batch(list(missing))
+                else:
+                    loaded = deadline.call(self._load_user_batch, list(missing))
+            except FuturesTimeoutError:
+                for key, requested in missing.items():
+                    try:
+                        user = self._loader_timed_out(key)
+                    except _LoaderTimedOut:
+                        user = None
+                    for user_id in requested:
+                        users[user_id] = user
+                return users
+
+            for key, requested in missing.items():
+                user = loaded.get(key)
+                if cache is not None:
+                    cache.set(state.cache_key(key), user)
+                for user_id in requested:
+                    users[user_id] = user
+
+        return users
+
+    def snapshot_dumper(self, callback):
+        """
+        This sets the callback for building a user snapshot. The function you
+        set should take a user object and return a small, JSON serializable
+        ``dict`` with what your application needs from the user on most
+        requests. Together with :meth:`snapshot_loader`, this enables user
+        snapshots.
+
+        :param callback: The callback for dumping a user object.
+        :type callback: callable
+        """
+        self._snapshot_dumper = callback
+        return callback
+
+    def snapshot_loader(self, callback):
+        """
+        This sets the callback for restoring a user from a snapshot. The
+        function you set should take a user ID (a ``str``) and the ``dict``
+        returned by the :meth:`snapshot_dumper` callback, and return a user
+        object.
+
+        :param callback: The callback for restoring a user object.
+        :type callback: callable
+        """
+        self._snapshot_loader = callback
+        return callback
+
     def request_loader(self, callback):
         """
         This sets the callback for loading a user from a Flask request.
         The function you set should take Flask request object and
         return a user object, or `None` if the user does not exist.
 
+        As with :meth:`user_loader`, the callback may be an ``async def``
+        function.
+
         :param callback: The callback for retrieving a user object.
         :type callback: callable
         """
@@ -213,6 +426,30 @@ class LoginManager:
         """Gets the request_loader callback set by request_loader decorator."""
         return self._request_callback
 
+    def invalidate(self, user_id, app=None):
+        """
+        Removes the user with the given ID from :attr:`user_cache`, so the
+        next request for that user calls the :meth:`user_loader` callback
+        again. Call this whenever a user object changes in a way that
+        matters to the rest of the request, e.g. it is deactivated.
+
+        :param user_id: The ID of the user to remove.
+        :type user_id: str
+        :param app: The app the user belongs to. Defaults to the current app,
+            or outside of an application context, to every app.
+        :type app: :class:`flask.Flask`
+        """
+        cache = self.user_cache
+        if cache is None:
+            return
+
+        if app is None and not has_app_context():
+            states = list(self._app_states.values())
+        else:
+            states = [self._app_state(app)]
+        for state in states:
+            cache.invalidate(state.cache_key(user_id))
+
     def unauthorized_handler(self, callback):
         """
         This will set the callback for the `unauthorized` method, which among
@@ -279,10 +516,9 @@ class LoginManager:
                     category=self.needs_refresh_message_category,
                 )
 
-        config = current_app.config
-        if config.get("USE_SESSION_FOR_NEXT", USE_SESSION_FOR_NEXT):
+        if self._config().use_session_for_next:
             login_url = expand_login_view(self.refresh_view)
-            session["_id"] = self._session_identifier_generator()
+            session["_id"] = self._session_identifier()
             session["next"] = make_next_param(login_url, request.url)
             redirect_url = make_login_url(self.refresh_view)
         else:
@@ -302,12 +538,7 @@ class LoginManager:
     def _load_user(self):
         """Loads user from session or remember_me cookie as applicable"""
 
-        if self._user_callback is None and self._request_callback is None:
-            raise Exception(
-                "Missing user_loader or request_loader. Refer to "
-                "http://flask-login.readthedocs.io/#how-it-works "
-                "for more info."
-            )
+        self._check_loaders()
 
         user_accessed.send(current_app._get_current_object())
 
@@ -317,71 +548,438 @@ class LoginManager:
 
         user = None
 
-        # Load user from Flask Session
-        user_id = session.get("_user_id")
-        if user_id is not None and self._user_callback is not None:
-            user = self._user_callback(user_id)
+        try:
+            # Load user from Flask Session
+            user_id = session.get("_user_id")
+            if user_id is not None and self._user_callback is not None:
+                user = self._load_user_from_snapshot(user_id)
+                if user is None:
+                    if self.lazy_user:
+                        user = _LazyUser(self, user_id)
+                        return self._update_request_context_with_user(user)
+                    user = self._load_user_by_id(user_id)
+                    self._update_snapshot(user_id, user)
+
+            # Load user from Remember Me Cookie or Request Loader
+            if user is None:
+                cookie = self._get_remember_cookie()
+                if cookie is not None:
+                    user = self._load_user_from_remember_cookie(cookie)
+                elif self._request_callback:
+                    user = self._load_user_from_request(request)
+        except _LoaderTimedOut:
+            user = None
 
-        # Load user from Remember Me Cookie or Request Loader
-        if user is None:
-            config = current_app.config
-            cookie_name = config.get("REMEMBER_COOKIE_NAME", COOKIE_NAME)
-            has_cookie = (
-                cookie_name in request.cookies and session.get("_remember") != "clear"
-            )
-            if has_cookie:
-                cookie = request.cookies[cookie_name]
-                user = self._load_user_from_remember_cookie(cookie)
-            elif self._request_callback:
-                user = self._load_user_from_request(request)
+        return self._update_request_context_with_user(user)
+
+    async def _load_user_async(self):
+        """Like :meth:`_load_user`, but awaits ``async def`` loader callbacks
+        instead of running them in a new event loop.
+        """
+
+        self._check_loaders()
+
+        user_accessed.send(current_app._get_current_object())
+
+        # Check SESSION_PROTECTION
+        if self._session_protection_failed():
+            return self._update_request_context_with_user()
+
+        user = None
+
+        try:
+            # Load user from Flask Session
+            user_id = session.get("_user_id")
+            if user_id is not None and self._user_callback is not None:
+                user = self._load_user_from_snapshot(user_id)
+                if user is None:
+                    user = await self._load_user_by_id_async(user_id)
+                    self._update_snapshot(user_id, user)
+
+            # Load user from Remember Me Cookie or Request Loader
+            if user is None:
+                cookie = self._get_remember_cookie()
+                if cookie is not None:
+                    user = await self._load_user_from_remember_cookie_async(cookie)
+                elif self._request_callback:
+                    user = await self._load_user_from_request_async(request)
+        except _LoaderTimedOut:
+            user = None
 
         return self._update_request_context_with_user(user)
 
-    def _session_protection_failed(self):
-        sess = session._get_current_object()
-        ident = self._session_identifier_generator()
+    def _check_loaders(self):
+        if self._user_callback is None and self._request_callback is None:
+            raise Exception(
+                "Missing user_loader or request_loader. Refer to "
+                "http://flask-login.readthedocs.io/#how-it-works "
+                "for more info."
+            )
+
+    def _get_remember_cookie(self):
+        cookie_name = self._config().cookie_name
+        if cookie_name in request.cookies and session.get("_remember") != "clear":
+            return request.cookies[cookie_name]
+        return None
+
+    def _load_user_by_id(self, user_id):
+        cache = self.user_cache
+        if cache is not None:
+            key = self._app_state().cache_key(user_id)
+            user = cache.get(key, _MISSING, self._make_refresh(user_id))
+            if user is not _MISSING:
+                return user
+
+        deadline = self.loader_deadline
+        if deadline is None:
+            user = self._call_user_loader(user_id)
+        else:
+            try:
+                user = deadline.call(self._call_user_loader, user_id)
+            except FuturesTimeoutError:
+                return self._loader_timed_out(user_id)
+
+        if cache is not None:
+            cache.set(key, user)
+        return user
+
+    def _call_user_loader(self, user_id):
+        if self.batch_scheduler is not None and self._user_batch_callback:
+            namespace = self._app_state().namespace
+            return self.batch_scheduler.load(user_id, self._load_user_batch, namespace)
+
+        callback = current_app.ensure_sync(self._user_callback)
+        if self.single_flight is not None:
+            key = self._app_state().cache_key(user_id)
+            return self.single_flight.do(key, callback, user_id)
+        return callback(user_id)
+
+    def _loader_timed_out(self, user_id=None):
+        deadline = self.loader_deadline
+        user_loader_timeout.send(current_app._get_current_object(), user_id=user_id)
+
+        if deadline.fallback == "abort":
+            abort(503)
+
+        if deadline.fallback == "stale" and user_id is not None:
+            if self.user_cache is not None:
+                key = self._app_state().cache_key(user_id)
+                user = self.user_cache.peek(key)
+                if user is not None:
+                    return user
+
+        raise _LoaderTimedOut()
+
+    async def _await_loader(self, callback, arg, user_id=None):
+        deadline = self.loader_deadline
+        if deadline is None:
+            return await _maybe_await(callback(arg))
+
+        if inspect.iscoroutinefunction(callback):
+            result = callback(arg)
+        else:
+            # a sync callback would block the event loop past the deadline
+            result = asyncio.wrap_future(deadline._submit(callback, arg))
+
+        try:
+            return await asyncio.wait_for(result, deadline.timeout)
+        except asyncio.TimeoutError:
+            return self._loader_timed_out(user_id)
+
+    def _make_refresh(self, user_id):
+        if not self.user_cache.stale_ttl:
+            return None
 
         app = current_app._get_current_object()
-        mode = app.config.get("SESSION_PROTECTION", self.session_protection)
+        callback = app.ensure_sync(self._user_callback)
 
-        if not mode or mode not in ["basic", "strong"]:
-            return False
+        def refresh():
+            with app.app_context():
+                try:
+                    return callback(user_id)
+                except Exception:
+                    app.logger.exception("Refreshing user %r failed", user_id)
+                    return _MISSING
+
+        return refresh
+
+    def _load_user_batch(self, user_ids):
+        callback = current_app.ensure_sync(self._user_batch_callback)
+        return {str(k): v for k, v in callback(user_ids).items()}
+
+    async def load_user_async(self, user_id):
+        """
+        Loads the user with the given ID through the :meth:`user_loader`
+        callback and :attr:`user_cache`. Unlike the synchronous code path, an
+        ``async def`` callback is awaited in the running event loop, so it
+        can overlap with other I/O of an async view, and the
+        :attr:`loader_deadline` is enforced with :func:`asyncio.wait_for`.
+        With a deadline, a synchronous callback is run on one of its workers
+        instead of blocking the event loop.
+        Loads made this way are not coalesced by :attr:`single_flight` or
+        :attr:`batch_scheduler`.
+
+        If the load misses the deadline, ``None`` is returned, or with the
+        ``"stale"`` fallback, the last cached user if there is one.
+
+        :param user_id: The ID of the user to load.
+        :type user_id: str
+        """
+        try:
+            return await self._load_user_by_id_async(user_id)
+        except _LoaderTimedOut:
+            return None
+
+    async def _load_user_by_id_async(self, user_id):
+        cache = self.user_cache
+        if cache is not None:
+            key = self._app_state().cache_key(user_id)
+            user = cache.get(key, _MISSING, self._make_refresh(user_id))
+            if user is not _MISSING:
+                return user
+
+        user = await self._await_loader(self._user_callback, user_id, user_id)
+        if cache is not None:
+            cache.set(key, user)
+        return user
+
+    def _load_user_from_snapshot(self, user_id):
+        if self._snapshot_loader is None:
+            return None
 
-        # if the sess is empty, it's an anonymous user or just logged out
-        # so we can skip this
-        if sess and ident != sess.get("_id", None):
-            if mode == "basic" or sess.permanent:
-                if sess.get("_fresh") is not False:
-                    sess["_fresh"] = False
-                session_protected.send(app)
-                return False
-            elif mode == "strong":
-                for k in SESSION_KEYS:
-                    sess.pop(k, None)
-
-                sess["_remember"] = "clear"
-                session_protected.send(app)
-                return True
+        snapshot = session.get("_user_snapshot")
+        try:
+            version, snapshot_id, active, generation, issued, data = snapshot
+        except (TypeError, ValueError):
+            return None
+
+        if (
+            version != _SNAPSHOT_VERSION
+            or snapshot_id != user_id
+            or not active
+            or generation != self.snapshot_generation
+        ):
+            return None
+
+        max_age = self._config().snapshot_max_age
+        if time.time() - issued > max_age.total_seconds():
+            return None
+
+        return self._snapshot_loader(user_id, data)
+
+    def _update_snapshot(self, user_id, user):
+        if self._snapshot_loader is None or self._snapshot_dumper is None:
+            return
+
+        # the session may have moved on, e.g. a lazy user loaded after logout
+        if session.get("_user_id") != user_id:
+            return
+
+        if user is None:
+            session.pop("_user_snapshot", None)
+            return
+
+        session["_user_snapshot"] = [
+            _SNAPSHOT_VERSION,
+            user_id,
+            bool(user.is_active),
+            self.snapshot_generation,
+            int(time.time()),
+            self._snapshot_dumper(user),
+        ]
+
+    def _session_identifier(self):
+        # the identifier only depends on the request, compute it once
+        ident = g.get("_login_session_id")
+        if ident is None:
+            ident = g._login_session_id = self._session_identifier_generator()
+        return ident
+
+    def _session_identifier_matches(self, ident, stored):
+        if stored == ident:
+            return True
+
+        # stored by another fingerprint, e.g. while rolling out a new one
+        if self._session_identifier_generator is _create_identifier and (
+            _identifier_matches(stored)
+        ):
+            session["_id"] = ident
+            return True
 
         return False
 
+    def _session_protection_failed(self):
+        policy = self._session_protection(current_app._get_current_object())
+        return policy.check(self, session._get_current_object())
+
+    def _session_protection(self, app):
+        state = self._app_state(app)
+        policy = state.session_protection
+        if policy is None:
+            mode = app.config.get("SESSION_PROTECTION", self.session_protection)
+            policy = state.session_protection = _SessionProtection(mode)
+        return policy
+
+    def _app_state(self, app=None):
+        if app is None:
+            app = current_app._get_current_object()
+        state = self._app_states.get(app)
+        if state is None:
+            with self._app_states_lock:
+                state = self._app_states.get(app)
+                if state is None:
+                    # the first app keeps plain cache keys, as with one app
+                    number = next(self._app_numbers)
+                    namespace = None if number == 0 else f"{app.name}:{number}"
+                    state = self._app_states[app] = _AppState(namespace)
+        return state
+
+    def _config(self):
+        state = self._app_state()
+        config = state.config
+        if config is None:
+            config = state.config = self._read_config(current_app.config)
+        return config
+
+    def _read_config(self, config):
+        snapshot = _LoginConfig(config)
+        # digests and fingerprints are registered here, not in the config
+        _check_registered(
+            "REMEMBER_COOKIE_DIGEST", snapshot.cookie_digest, self.cookie_digests
+        )
+        _check_registered(
+            "SESSION_FINGERPRINT",
+            snapshot.session_fingerprint,
+            self.session_fingerprints,
+        )
+        return snapshot
+
+    def _cookie_settings(self):
+        state = self._app_state()
+        config = current_app.config
+        keys = (config["SECRET_KEY"], tuple(config.get("SECRET_KEY_FALLBACKS") or ()))
+        settings = state.cookie_settings
+        if (
+            settings is None
+            or state.cookie_keys != keys
+            or settings.digests is not self.cookie_digests
+        ):
+            settings = state.cookie_settings = _build_cookie_settings()
+            state.cookie_keys = keys
+        return settings
+
+    def refresh_config(self, app=None):
+        """
+        The ``REMEMBER_COOKIE_*``, ``SESSION_FINGERPRINT``,
+        ``USE_SESSION_FOR_NEXT`` and ``USER_SNAPSHOT_MAX_AGE`` settings are
+        read from the config of an app once, the first time they are needed,
+        and kept in a read-only snapshot. Call this after changing any of them
+        later, to read them again. This also sets up session protection again,
+        like :meth:`refresh_session_protection`.
+
+        :param app: The app to read the config of. Defaults to the current
+            app.
+        :type app: :class:`flask.Flask`
+        """
+        if app is None:
+            app = current_app._get_current_object()
+        state = self._app_state(app)
+        state.reset()
+        state.config = self._read_config(app.config)
+
+    def refresh_session_protection(self, app=None):
+        """
+        Session protection is set up for an app once, from its
+        ``SESSION_PROTECTION`` config or :attr:`session_protection`, the first
+        time a user is loaded. Call this after changing either of them later,
+        to set it up again. This also resets its counters.
+
+        :param app: The app to set up again. Defaults to the current app.
+        :type app: :class:`flask.Flask`
+        """
+        self._app_state(app).session_protection = None
+
+    def session_protection_counters(self, app=None):
+        """
+        Returns how often each branch of session protection was taken for an
+        app, as a ``dict`` mapping ``"disabled"``, ``"anonymous"``,
+        ``"matched"``, ``"marked_unfresh"`` and ``"cleared"`` to counts.
+
+        :param app: The app to get the counters of. Defaults to the current
+            app.
+        :type app: :class:`flask.Flask`
+        """
+        if app is None:
+            app = current_app._get_current_object()
+        return self._session_protection(app).counters()
+
     def _load_user_from_remember_cookie(self, cookie):
-        user_id = decode_cookie(cookie)
+        user_id = self._user_id_from_remember_cookie(cookie)
         if user_id is not None:
-            session["_user_id"] = user_id
-            session["_fresh"] = False
             user = None
             if self._user_callback:
-                user = self._user_callback(user_id)
+                user = self._load_user_by_id(user_id)
             if user is not None:
                 app = current_app._get_current_object()
                 user_loaded_from_cookie.send(app, user=user)
                 return user
         return None
 
+    async def _load_user_from_remember_cookie_async(self, cookie):
+        user_id = self._user_id_from_remember_cookie(cookie)
+        if user_id is not None:
+            user = None
+            if self._user_callback:
+                user = await self._load_user_by_id_async(user_id)
+            if user is not None:
+                app = current_app._get_current_object()
+                user_loaded_from_cookie.send(app, user=user)
+                return user
+        return None
+
+    def _user_id_from_remember_cookie(self, cookie):
+        if self.token_store is not None:
+            user_id, stale = self._token_owner(cookie)
+            if user_id is not None:
+                session["_user_id"] = user_id
+                session["_fresh"] = False
+                if stale:
+                    # issued under a fallback key, bind it to the current one
+                    session["_remember"] = "set"
+                return user_id
+
+        require_expiry = self._config().cookie_sign_expiry
+        user_id, stale = _verify_cookie(cookie, require_expiry=require_expiry)
+        if user_id is not None:
+            if self.token_store is not None:
+                # a signed cookie from before the token store, replace it
+                stale = True
+            session["_user_id"] = user_id
+            session["_fresh"] = False
+            if stale:
+                # signed with a fallback key or an old digest, re-issue it
+                session["_remember"] = "set"
+        return user_id
+
     def _load_user_from_request(self, request):
         if self._request_callback:
-            user = self._request_callback(request)
+            callback = current_app.ensure_sync(self._request_callback)
+            if self.loader_deadline is None:
+                user = callback(request)
+            else:
+                try:
+                    user = self.loader_deadline.call(callback, request)
+                except FuturesTimeoutError:
+                    user = self._loader_timed_out()
+            if user is not None:
+                app = current_app._get_current_object()
+                user_loaded_from_request.send(app, user=user)
+                return user
+        return None
+
+    async def _load_user_from_request_async(self, request):
+        if self._request_callback:
+            user = await self._await_loader(self._request_callback, request)
             if user is not None:
                 app = current_app._get_current_object()
                 user_loaded_from_request.send(app, user=user)
@@ -390,8 +988,12 @@ class LoginManager:
 
     def _update_remember_cookie(self, response):
         # Don't modify the session unless there's something to do.
-        if "_remember" not in session and current_app.config.get(
-            "REMEMBER_COOKIE_REFRESH_EACH_REQUEST"
+        if "_remember" not in session and (
+            (
+                self._config().cookie_refresh_each_request
+                and self._remember_cookie_needs_refresh()
+            )
+            or self._remember_cookie_is_outdated()
         ):
             session["_remember"] = "set"
 
@@ -405,51 +1007,295 @@ class LoginManager:
 
         return response
 
+    def _remember_cookie_needs_refresh(self):
+        threshold = self._config().cookie_refresh_threshold
+        expires = session.get("_remember_expires")
+        if threshold is None or expires is None:
+            return True
+
+        remaining = expires - datetime.now(timezone.utc).timestamp()
+        return remaining < threshold.total_seconds()
+
+    def _remember_cookie_is_outdated(self):
+        if "_user_id" not in session or self.token_store is not None:
+            return False
+
+        cookie = self._get_remember_cookie()
+        if cookie is None or not _cookie_is_outdated(cookie):
+            return False
+
+        # only re-issue a genuine cookie of the user the session holds, the
+        # outdated check above also covers cookies missing a required expiry
+        user_id, stale = _verify_cookie(cookie)
+        stale = stale or self._config().cookie_sign_expiry
+        return stale and user_id == str(session["_user_id"])
+
     def _set_cookie(self, response):
         # cookie settings
-        config = current_app.config
-        cookie_name = config.get("REMEMBER_COOKIE_NAME", COOKIE_NAME)
-        domain = config.get("REMEMBER_COOKIE_DOMAIN")
-        path = config.get("REMEMBER_COOKIE_PATH", "/")
-
-        secure = config.get("REMEMBER_COOKIE_SECURE", COOKIE_SECURE)
-        httponly = config.get("REMEMBER_COOKIE_HTTPONLY", COOKIE_HTTPONLY)
-        samesite = config.get("REMEMBER_COOKIE_SAMESITE", COOKIE_SAMESITE)
+        config = self._config()
 
         if "_remember_seconds" in session:
             duration = timedelta(seconds=session["_remember_seconds"])
         else:
-            duration = config.get("REMEMBER_COOKIE_DURATION", COOKIE_DURATION)
+            duration = config.cookie_duration
 
-        # prepare data
-        data = encode_cookie(str(session["_user_id"]))
+        expires = datetime.now(timezone.utc) + duration
 
-        if isinstance(duration, int):
-            duration = timedelta(seconds=duration)
+        # prepare data
+        if self.token_store is not None:
+            data = self._issue_remember_token(str(session["_user_id"]), expires)
+        elif config.cookie_sign_expiry:
+            data = encode_cookie(str(session["_user_id"]), expires=expires)
+        else:
+            data = self._encode_remember_cookie(str(session["_user_id"]))
 
-        try:
-            expires = datetime.now(timezone.utc) + duration
-        except TypeError as e:
-            raise Exception(
-                "REMEMBER_COOKIE_DURATION must be a datetime.timedelta,"
-                f" instead got: {duration}"
-            ) from e
+        if config.cookie_refresh_threshold is not None:
+            # lets _remember_cookie_needs_refresh() skip the next renewals
+            session["_remember_expires"] = int(expires.timestamp())
 
         # actually set it
         response.set_cookie(
-            cookie_name,
+            config.cookie_name,
             value=data,
             expires=expires,
-            domain=domain,
-            path=path,
-            secure=secure,
-            httponly=httponly,
-            samesite=samesite,
+            domain=config.cookie_domain,
+            path=config.cookie_path,
+            secure=config.cookie_secure,
+            httponly=config.cookie_httponly,
+            samesite=config.cookie_samesite,
         )
 
+    def _encode_remember_cookie(self, user_id):
+        # without an expiry time, the cookie only depends on the user ID and
+        # the settings, so it is signed once per user until they change
+        settings = self._cookie_settings()
+        cache = self._app_state().encoded_cookies
+        cookie = cache.get(settings, user_id)
+        if cookie is None:
+            cookie = _encode_cookie(user_id, settings)
+            cache.set(settings, user_id, cookie)
+        return cookie
+
+    def _token_owner(self, token):
+        """Return ``(user_id, stale)`` for a remember token, like
+        `_verify_cookie`. Tokens are bound to the key of the app that issued
+        them, so apps with other keys sharing the store don't accept them.
+        """
+        entry = self.token_store.lookup(token)
+        if entry is None:
+            return None, False
+
+        user_id, key_id = entry
+        settings = self._cookie_settings()
+        if key_id not in settings.keys:
+            return None, False
+        return user_id, key_id != settings.key_id
+
+    def _issue_remember_token(self, user_id, expires):
+        store = self.token_store
+        token = request.cookies.get(self._config().cookie_name)
+        if token is not None:
+            owner = self._token_owner(token)[0]
+            if owner != user_id:
+                if owner is not None:
+                    store.revoke(token)
+                token = None
+
+        # keep the device's token when refreshing it, so requests racing with
+        # this response still carry a valid one
+        if token is None:
+            token = secrets.token_urlsafe(32)
+        key_id = self._cookie_settings().key_id
+        store.set(token, user_id, expires.timestamp(), key_id)
+        return token
+
     def _clear_cookie(self, response):
-        config = current_app.config
-        cookie_name = config.get("REMEMBER_COOKIE_NAME", COOKIE_NAME)
-        domain = config.get("REMEMBER_COOKIE_DOMAIN")
-        path = config.get("REMEMBER_COOKIE_PATH", "/")
-        response.delete_cookie(cookie_name, domain=domain, path=path)
+        config = self._config()
+        cookie_name = config.cookie_name
+        token = request.cookies.get(cookie_name)
+        if self.token_store is not None and token is not None:
+            # leave tokens of other apps sharing the store alone
+            if self._token_owner(token)[0] is not None:
+                self.token_store.revoke(token)
+        response.delete_cookie(
+            cookie_name, domain=config.cookie_domain, path=config.cookie_path
+        )
+
+
+def _check_registered(name, value, registered):
+    if value not in registered:
+        raise Exception(
+            f"{name} must be one of {sorted(registered)}, instead got: {value}"
+        )
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        value = await value
+    return value
+
+
+class _AppState:
+    """What a :class:`LoginManager` derives from one app: its config
+    snapshot, session protection and cookie settings, and the namespace of its
+    users in the caches shared by all apps.
+    """
+
+    __slots__ = (
+        "namespace",
+        "config",
+        "session_protection",
+        "cookie_keys",
+        "cookie_settings",
+        "encoded_cookies",
+    )
+
+    def __init__(self, namespace):
+        self.namespace = namespace
+        self.encoded_cookies = CookieCache(maxsize=1024)
+        self.reset()
+
+    def reset(self):
+        self.config = None
+        self.session_protection = None
+        self.cookie_keys = None
+        self.cookie_settings = None
+
+    def cache_key(self, user_id):
+        if self.namespace is None:
+            return str(user_id)
+        return f"{self.namespace}\x1f{user_id}"
+
+
+class _SessionProtection:
+    """Session protection set up for one app. The mode is resolved once, and
+    the session identifier is only computed for sessions that hold a user.
+    """
+
+    __slots__ = ("mode", "_counters", "_lock")
+
+    def __init__(self, mode):
+        self.mode = mode if mode in ("basic", "strong") else None
+        self._counters = dict.fromkeys(
+            ("disabled", "anonymous", "matched", "marked_unfresh", "cleared"), 0
+        )
+        self._lock = threading.Lock()
+
+    def _count(self, outcome):
+        # request threads share the policy, so don't lose increments
+        with self._lock:
+            self._counters[outcome] += 1
+
+    def counters(self):
+        with self._lock:
+            return dict(self._counters)
+
+    def check(self, login_manager, sess):
+        """Return ``True`` if `sess` was cleared because it failed."""
+        if self.mode is None:
+            self._count("disabled")
+            return False
+
+        # an empty or anonymous session has no user to protect
+        if "_user_id" not in sess:
+            self._count("anonymous")
+            return False
+
+        ident = login_manager._session_identifier()
+        if login_manager._session_identifier_matches(ident, sess.get("_id")):
+            self._count("matched")
+            return False
+
+        app = current_app._get_current_object()
+        if self.mode == "basic" or sess.permanent:
+            if sess.get("_fresh") is not False:
+                sess["_fresh"] = False
+            self._count("marked_unfresh")
+            session_protected.send(app)
+            return False
+
+        for k in SESSION_KEYS:
+            sess.pop(k, None)
+
+        sess["_remember"] = "clear"
+        self._count("cleared")
+        session_protected.send(app)
+        return True
+
+
+class _LoaderTimedOut(Exception):
+    """Raised when a loader callback misses the :class:`LoaderDeadline` and
+    the request should continue as anonymous.
+    """
+
+
+#: The layout version of user snapshots stored in the session.
+_SNAPSHOT_VERSION = 1
+
+
+class _LazyUser:
+    """Stands in for a user restored from the session when
+    :attr:`LoginManager.lazy_user` is enabled. The user ID in the session was
+    already verified, so ``is_authenticated``, ``is_anonymous`` and
+    ``get_id()`` are answered from it; anything else loads the user (at most
+    once) and is delegated to it. If the user no longer exists, an anonymous
+    user is used instead.
+    """
+
+    __slots__ = ("_login_manager", "_user_id", "_user")
+
+    def __init__(self, login_manager, user_id):
+        self._login_manager = login_manager
+        self._user_id = user_id
+        self._user = None
+
+    def _get_current_object(self):
+        if self._user is None:
+            try:
+                user = self._login_manager._load_user_by_id(self._user_id)
+                self._login_manager._update_snapshot(self._user_id, user)
+            except _LoaderTimedOut:
+                user = None
+            if user is None:
+                user = self._login_manager.anonymous_user()
+            self._user = user
+        return self._user
+
+    @property
+    def is_authenticated(self):
+        if self._user is None:
+            return True
+        return self._user.is_authenticated
+
+    @property
+    def is_anonymous(self):
+        if self._user is None:
+            return False
+        return self._user.is_anonymous
+
+    def get_id(self):
+        if self._user is None:
+            return self._user_id
+        return self._user.get_id()
+
+    def __getattr__(self, name):
+        return getattr(self._get_current_object(), name)
+
+    def __eq__(self, other):
+        if isinstance(other, _LazyUser):
+            other = other._get_current_object()
+        return self._get_current_object() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self._get_current_object())
+
+    def __str__(self):
+        return str(self._get_current_object())
+
+    def __repr__(self):
+        if self._user is None:
+            return f"<{type(self).__name__} {self._user_id!r} (not loaded)>"
+        return repr(self._user)
@@ -48,4 +48,12 @@ user_accessed = _signals.signal("accessed")
 #: marked non-fresh or deleted. It receives no additional arguments besides
 #: the app.
 # 每当会话保护机制生效（会话被标记为非新鲜或被删除）时发送。除了应用实例外，不接收其他额外参数。
-session_protected = _signals.signal("session-protected")
\ No newline at end of file
+session_protected = _signals.signal("session-protected")
+
+#: Sent when a ``user_loader`` or ``request_loader`` callback misses the
+#: deadline set with ``LoginManager.loader_deadline``. In addition to the app
+#: (which is the sender), it is passed `user_id`, which is the ID of the user
+#: being loaded, or ``None`` for the ``request_loader``.
+# 当 ``user_loader`` 或 ``request_loader`` 回调超过 ``LoginManager.loader_deadline`` 设置的期限时发送。
+# 除了应用实例（作为发送者）外，还会传递 `user_id` 参数，即正在加载的用户 ID；对于 ``request_loader`` 则为 ``None``。
+user_loader_timeout = _signals.signal("loader-timeout")
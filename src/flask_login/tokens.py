@@ -0,0 +1,213 @@
+import sqlite3
+import threading
+import time
+from abc import ABC
+from abc import abstractmethod
+from hashlib import sha256
+
+
+class TokenStore(ABC):
+    """The interface of the stores behind opaque remember tokens. Assign an
+    instance to :attr:`LoginManager.token_store` to have the "remember me"
+    cookie hold a random token, resolved to the user ID through the store,
+    instead of the signed user ID. Tokens can then be revoked one device at a
+    time with :meth:`revoke`, or for all devices of a user with
+    :meth:`revoke_user`.
+
+    Each token is stored with a namespace, which the :class:`LoginManager`
+    sets to the ID of the secret key of the app issuing it, so apps with
+    different keys sharing a store don't accept each other's tokens.
+
+    Tokens are only stored as their SHA-256 digest, so a leaked store cannot
+    be used to forge cookies. Subclasses implement the ``_set``, ``_get``,
+    ``_revoke``, ``revoke_user`` and ``sweep`` methods in terms of that
+    digest; a subclass missing any of them cannot be instantiated.
+    """
+
+    def set(self, token, user_id, expires, namespace=None):
+        """Store `token` for `user_id` in `namespace` until `expires`, given as
+        a UNIX timestamp. If `token` is stored already, it is replaced.
+        """
+        self._set(_hash_token(token), str(user_id), expires, namespace)
+
+    def get(self, token):
+        """Return the user ID `token` belongs to, or ``None`` if it is
+        unknown, revoked or expired.
+        """
+        entry = self.lookup(token)
+        return None if entry is None else entry[0]
+
+    def lookup(self, token):
+        """Return a ``(user_id, namespace)`` tuple for `token`, or ``None`` if
+        it is unknown, revoked or expired.
+        """
+        return self._get(_hash_token(token), time.time())
+
+    def revoke(self, token):
+        """Revoke `token`, logging out the device that holds it."""
+        self._revoke(_hash_token(token))
+
+    @abstractmethod
+    def revoke_user(self, user_id):
+        """Revoke every token of `user_id`."""
+
+    @abstractmethod
+    def sweep(self):
+        """Delete every expired token."""
+
+    @abstractmethod
+    def _set(self, token_hash, user_id, expires, namespace):
+        """Store `token_hash`, replacing it if it is stored already."""
+
+    @abstractmethod
+    def _get(self, token_hash, now):
+        """Return ``(user_id, namespace)`` for `token_hash`, or ``None`` if it
+        is unknown or expires at or before `now`.
+        """
+
+    @abstractmethod
+    def _revoke(self, token_hash):
+        """Delete `token_hash`, if it is stored."""
+
+
+def _hash_token(token):
+    return sha256(token.encode("utf-8")).hexdigest()
+
+
+class MemoryTokenStore(TokenStore):
+    """A :class:`TokenStore` keeping the tokens in a dict. Tokens are lost
+    when the process exits, and are not shared between processes, so this is
+    meant for tests and single process deployments.
+    """
+
+    def __init__(self):
+        self._tokens = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def _set(self, token_hash, user_id, expires, namespace):
+        with self._lock:
+            self._discard(token_hash)
+            self._tokens[token_hash] = (user_id, expires, namespace)
+            self._users.setdefault(user_id, set()).add(token_hash)
+
+    def _get(self, token_hash, now):
+        entry = self._tokens.get(token_hash)
+        if entry is None or entry[1] <= now:
+            return None
+        return entry[0], entry[2]
+
+    def _revoke(self, token_hash):
+        with self._lock:
+            self._discard(token_hash)
+
+    def revoke_user(self, user_id):
+        with self._lock:
+            for token_hash in self._users.pop(str(user_id), ()):
+                self._tokens.pop(token_hash, None)
+
+    def sweep(self):
+        now = time.time()
+        with self._lock:
+            expired = [h for h, entry in self._tokens.items() if entry[1] <= now]
+            for token_hash in expired:
+                self._discard(token_hash)
+
+    def _discard(self, token_hash):
+        entry = self._tokens.pop(token_hash, None)
+        if entry is not None:
+            hashes = self._users.get(entry[0])
+            hashes.discard(token_hash)
+            if not hashes:
+                del self._users[entry[0]]
+
+    def __len__(self):
+        return len(self._tokens)
+
+
+class SQLiteTokenStore(TokenStore):
+    """A :class:`TokenStore` keeping the tokens in a SQLite database, which
+    several processes on the same host can share.
+
+    Tokens are looked up by the primary key of a ``WITHOUT ROWID`` table, and
+    indexes on the user ID and expiry time keep :meth:`revoke_user` and
+    :meth:`sweep` from scanning the table. All queries are parameterized, so
+    SQLite reuses their prepared statements. Expired tokens are swept at most
+    once every `sweep_interval` seconds when a token is stored.
+
+    :param path: The path of the database file, or ``":memory:"``.
+    :type path: str
+    :param table: The name of the table to keep the tokens in. Defaults to
+        ``"remember_tokens"``.
+    :type table: str
+    :param sweep_interval: How often expired tokens are deleted, in seconds.
+        Defaults to one hour. Set to ``None`` to only sweep when
+        :meth:`sweep` is called.
+    :type sweep_interval: int
+    """
+
+    def __init__(self, path, table="remember_tokens", sweep_interval=3600):
+        if not table.isidentifier():
+            raise ValueError(f"table must be a valid identifier, got: {table!r}")
+
+        self.table = table
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+        self._connection.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                token_hash TEXT PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                expires REAL NOT NULL,
+                namespace TEXT
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS {table}_user_id ON {table} (user_id);
+            CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires);
+            """
+        )
+        self._insert = f"INSERT OR REPLACE INTO {table} VALUES (?, ?, ?, ?)"
+        self._select = (
+            f"SELECT user_id, namespace FROM {table}"
+            " WHERE token_hash = ? AND expires > ?"
+        )
+        self._delete = f"DELETE FROM {table} WHERE token_hash = ?"
+        self._delete_user = f"DELETE FROM {table} WHERE user_id = ?"
+        self._delete_expired = f"DELETE FROM {table} WHERE expires <= ?"
+
+    def _execute(self, sql, parameters):
+        with self._lock:
+            return self._connection.execute(sql, parameters).fetchone()
+
+    def _set(self, token_hash, user_id, expires, namespace):
+        self._execute(self._insert, (token_hash, user_id, expires, namespace))
+        if (
+            self.sweep_interval is not None
+            and time.monotonic() - self._last_sweep >= self.sweep_interval
+        ):
+            self.sweep()
+
+    def _get(self, token_hash, now):
+        row = self._execute(self._select, (token_hash, now))
+        return None if row is None else tuple(row)
+
+    def _revoke(self, token_hash):
+        self._execute(self._delete, (token_hash,))
+
+    def revoke_user(self, user_id):
+        self._execute(self._delete_user, (str(user_id),))
+
+    def sweep(self):
+        self._last_sweep = time.monotonic()
+        self._execute(self._delete_expired, (time.time(),))
+
+    def close(self):
+        """Close the database connection."""
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        return self._execute(f"SELECT COUNT(*) FROM {self.table}", ())[0]
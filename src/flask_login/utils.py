@@ -1,20 +1,33 @@
 import hmac
+import inspect
+import time
+from base64 import b64decode
+from base64 import urlsafe_b64encode
+from collections import namedtuple
+from functools import lru_cache
 from functools import wraps
+from hashlib import blake2b
+from hashlib import sha256
 from hashlib import sha512
 from urllib.parse import parse_qs
 from urllib.parse import urlencode
 from urllib.parse import urlsplit
 from urllib.parse import urlunsplit
+from uuid import UUID
 
 from flask import current_app
 from flask import g
+from flask import has_app_context
 from flask import has_request_context
 from flask import request
 from flask import session
 from flask import url_for
 from werkzeug.local import LocalProxy
 
-from .config import COOKIE_NAME
+from .config import _LoginConfig
+from .config import COOKIE_DIGEST
+from .config import COOKIE_FORMAT
+from .config import COOKIE_MAC_SIZE
 from .config import EXEMPT_METHODS
 from .signals import user_logged_in
 from .signals import user_logged_out
@@ -25,25 +38,50 @@ from .signals import user_login_confirmed
 current_user = LocalProxy(lambda: _get_user())
 
 
-def encode_cookie(payload, key=None):
+def encode_cookie(payload, key=None, expires=None):
     """
     This will encode a ``str`` value into a cookie, and sign that cookie
     with the app's secret key.
 
+    The cookie is signed with the digest named by ``REMEMBER_COOKIE_DIGEST``
+    from :attr:`LoginManager.cookie_digests` (HMAC-SHA512 by default). Other
+    digests are tagged with their name, along with the ID of the key the
+    cookie was signed with. If ``SECRET_KEY_FALLBACKS`` is configured, the
+    key ID is included for the default digest as well, so `decode_cookie`
+    can pick the right key without trying each of them.
+
+    If ``REMEMBER_COOKIE_FORMAT`` is ``"compact"``, the payload and a keyed
+    BLAKE2b MAC of ``REMEMBER_COOKIE_MAC_SIZE`` bytes are packed together and
+    base64url encoded instead. Numeric and UUID payloads are stored in binary.
+
     :param payload: The value to encode, as `str`.
     :type payload: str
 
     :param key: The key to use when creating the cookie digest. If not
                 specified, the SECRET_KEY value from app config will be used.
     :type key: str
+
+    :param expires: When the cookie expires. If given, the time is signed
+                    along with the payload, and `decode_cookie` rejects the
+                    cookie once it has passed. Defaults to ``None``, which
+                    makes the cookie valid for as long as the key is.
+    :type expires: :class:`datetime.datetime`
     """
-    return f"{payload}|{_cookie_digest(payload, key=key)}"
+    if expires is not None:
+        expires = int(expires.timestamp())
+    return _encode_cookie(payload, _cookie_settings(key), expires)
 
 
 def decode_cookie(cookie, key=None):
     """
     This decodes a cookie given by `encode_cookie`. If verification of the
-    cookie fails, ``None`` will be implicitly returned.
+    cookie fails, or its signed expiry time has passed, ``None`` will be
+    implicitly returned.
+
+    Cookies signed with one of the ``SECRET_KEY_FALLBACKS``, with any digest
+    in :attr:`LoginManager.cookie_digests`, or in either format, are accepted
+    as well, so rotating ``SECRET_KEY`` or changing ``REMEMBER_COOKIE_DIGEST``
+    or ``REMEMBER_COOKIE_FORMAT`` does not log out remembered users.
 
     :param cookie: An encoded cookie.
     :type cookie: str
@@ -52,15 +90,338 @@ def decode_cookie(cookie, key=None):
                 specified, the SECRET_KEY value from app config will be used.
     :type key: str
     """
+    return _verify_cookie(cookie, key=key)[0]
+
+
+#: Everything needed to sign and verify cookies, taken from the app config by
+#: `_cookie_settings`, so cookies can be handled outside of an app context.
+_CookieSettings = namedtuple(
+    "_CookieSettings", "key_id keys cookie_format mac_size digest_name digests"
+)
+
+
+def _cookie_settings(key=None):
+    if key is not None and not has_app_context():
+        # with an explicit key, cookies can be handled without an app, using
+        # the default digest and format
+        key_id, keys = _key_ring(key)
+        return _CookieSettings(
+            key_id, keys, COOKIE_FORMAT, COOKIE_MAC_SIZE, COOKIE_DIGEST, COOKIE_DIGESTS
+        )
+
+    login_manager = getattr(current_app, "login_manager", None)
+    if key is None and login_manager is not None:
+        return login_manager._cookie_settings()
+    return _build_cookie_settings(key)
+
+
+def _build_cookie_settings(key=None):
+    config = _login_config()
+    key_id, keys = _key_ring(key)
+    digest_name, digests = _cookie_digests()
+    return _CookieSettings(
+        key_id, keys, config.cookie_format, config.cookie_mac_size, digest_name, digests
+    )
+
+
+def _encode_cookie(payload, settings, expires=None):
+    key_id, keys, cookie_format, mac_size, digest_name, digests = settings
+    if cookie_format == "compact":
+        return _sign_compact_cookie(payload, key_id, keys, mac_size, expires)
+    return _sign_cookie(payload, key_id, keys, digest_name, digests, expires)
+
+
+def _decode_cookie(cookie, settings):
+    """Return ``(payload, stale, expires)`` for `cookie`, without checking
+    whether it has expired.
+    """
+    if "|" not in cookie:
+        return _verify_compact_cookie(cookie, settings)
+    return _verify_text_cookie(cookie, settings)
+
+
+def _sign_cookie(payload, key_id, keys, digest_name, digests, expires=None):
+    func = digests.get(digest_name)
+    if func is None:
+        raise Exception(
+            f"REMEMBER_COOKIE_DIGEST must be one of {sorted(digests)},"
+            f" instead got: {digest_name}"
+        )
+
+    if expires is not None:
+        digest = func(f"{payload}|{expires}", _expiry_key(keys[key_id]))
+        return f"{payload}|{digest_name}.{key_id}.{expires}.{digest}"
+
+    digest = func(payload, keys[key_id])
+    if digest_name != _LEGACY_DIGEST:
+        return f"{payload}|{digest_name}.{key_id}.{digest}"
+    if len(keys) > 1:
+        return f"{payload}|{key_id}.{digest}"
+    return f"{payload}|{digest}"
+
+
+def _split_cookie(cookie):
+    """Split `cookie` into ``(payload, digest_name, key_id, expires,
+    digest)``, or return ``None`` if it is malformed. `key_id` and `expires`
+    are ``None`` if the cookie does not carry them.
+    """
+    try:
+        payload, signature = cookie.rsplit("|", 1)
+        if hasattr(signature, "decode"):
+            signature = signature.decode("ascii")  # pragma: no cover
+    except ValueError:
+        return None
+
+    fields = signature.split(".")
+    if len(fields) == 1:
+        return payload, _LEGACY_DIGEST, None, None, fields[0]
+    if len(fields) == 2:
+        return payload, _LEGACY_DIGEST, fields[0], None, fields[1]
+    if len(fields) == 3:
+        return payload, fields[0], fields[1] or None, None, fields[2]
+    if len(fields) == 4 and fields[2].isascii() and fields[2].isdigit():
+        return payload, fields[0], fields[1] or None, int(fields[2]), fields[3]
+    return None
+
+
+def _verify_cookie(cookie, key=None, require_expiry=False):
+    """Verify `cookie` like `decode_cookie`, and return a ``(payload, stale)``
+    tuple, where `stale` tells whether the cookie should be re-issued with the
+    current key and digest. With `require_expiry`, cookies without a signed
+    expiry time are refused, as they would never expire.
+    """
+    settings = _cookie_settings(key)
+    login_manager = None
+    if key is None:
+        login_manager = getattr(current_app, "login_manager", None)
+    cache = None if login_manager is None else login_manager.cookie_cache
+    if cache is None:
+        payload, stale, expires = _decode_cookie(cookie, settings)
+    else:
+        # the result depends on the app and its settings, flush when they change
+        namespace = login_manager._app_state().namespace
+        result = cache.get(settings, cookie, namespace)
+        if result is None:
+            result = _decode_cookie(cookie, settings)
+            if result[0] is not None:
+                cache.set(settings, cookie, result, namespace)
+        payload, stale, expires = result
+
+    # checked on every call, cached cookies expire as well
+    if expires is None:
+        if require_expiry:
+            return None, False
+    elif expires <= time.time():
+        return None, False
+    return payload, stale
+
+
+def _verify_text_cookie(cookie, settings):
+    parts = _split_cookie(cookie)
+    if parts is None:
+        return None, False, None
+
+    payload, digest_name, key_id, expires, digest = parts
+    current_key_id, keys, cookie_format, _, current_digest_name, digests = settings
+    func = digests.get(digest_name)
+    if func is None:
+        return None, False, None
+
+    message = payload if expires is None else f"{payload}|{expires}"
+    for candidate_id, candidate in _candidate_keys(key_id, keys):
+        if candidate is None:
+            continue
+        if expires is not None:
+            candidate = _expiry_key(candidate)
+        if hmac.compare_digest(func(message, candidate), digest):
+            stale = (
+                cookie_format != "text"
+                or digest_name != current_digest_name
+                or candidate_id != current_key_id
+                or (key_id is None and len(keys) > 1)
+            )
+            return payload, stale, expires
+
+    return None, False, None
+
+
+def _candidate_keys(key_id, keys):
+    if key_id is not None:
+        # the key ID only selects the key, a forged one fails verification
+        return ((key_id, keys.get(key_id)),)
+    return keys.items()
+
+
+#: The kinds of payload a compact cookie holds, in the low bits of its header
+_COMPACT_STR = 0
+_COMPACT_INT = 1
+_COMPACT_UUID = 2
+_COMPACT_KIND_MASK = 0x03
+
+#: Payload kind telling the payload is preceded by a byte holding its actual
+#: kind and a 4 byte expiry time
+_COMPACT_EXPIRES = 3
+
+#: Header flag telling the compact cookie carries a 4 byte key ID
+_COMPACT_KEY_ID = 0x04
+
+
+def _sign_compact_cookie(payload, key_id, keys, mac_size, expires=None):
+    # header: payload kind in bits 0-1, key ID flag in bit 2 and the MAC size
+    # minus one in bits 3-7, so it is covered by the MAC as well
+    kind, data = _pack_payload(payload)
+    if expires is not None:
+        expires = min(max(expires, 0), 2**32 - 1)
+        data = bytes((kind,)) + expires.to_bytes(4, "big") + data
+        kind = _COMPACT_EXPIRES
+
+    header = kind | (mac_size - 1) << 3
+    if len(keys) > 1:
+        header |= _COMPACT_KEY_ID
+        data = bytes.fromhex(key_id) + data
+
+    body = bytes((header,)) + data
+    mac = _compact_mac(body, keys[key_id], mac_size)
+    return urlsafe_b64encode(body + mac).rstrip(b"=").decode("ascii")
+
+
+def _split_compact_cookie(cookie):
+    """Split a compact `cookie` into ``(body, key_id, mac_size, mac)``, or
+    return ``None`` if it is malformed.
+    """
     try:
-        payload, digest = cookie.rsplit("|", 1)
-        if hasattr(digest, "decode"):
-            digest = digest.decode("ascii")  # pragma: no cover
+        raw = b64decode(cookie + "=" * (-len(cookie) % 4), b"-_", validate=True)
     except ValueError:
-        return
+        return None
+
+    if not raw:
+        return None
 
-    if hmac.compare_digest(_cookie_digest(payload, key=key), digest):
-        return payload
+    header = raw[0]
+    mac_size = (header >> 3) + 1
+    key_id_size = 4 if header & _COMPACT_KEY_ID else 0
+    if len(raw) < 1 + key_id_size + mac_size:
+        return None
+
+    body, mac = raw[:-mac_size], raw[-mac_size:]
+    key_id = body[1 : 1 + key_id_size].hex() or None
+    return body, key_id, mac_size, mac
+
+
+def _verify_compact_cookie(cookie, settings):
+    parts = _split_compact_cookie(cookie)
+    if parts is None:
+        return None, False, None
+
+    body, key_id, mac_size, mac = parts
+    current_key_id, keys, cookie_format, current_mac_size, _, _ = settings
+    if mac_size < current_mac_size:
+        # never accept a MAC shorter than configured
+        return None, False, None
+
+    for candidate_id, candidate in _candidate_keys(key_id, keys):
+        if candidate is not None and hmac.compare_digest(
+            _compact_mac(body, candidate, mac_size), mac
+        ):
+            data = body[5:] if key_id is not None else body[1:]
+            kind = body[0] & _COMPACT_KIND_MASK
+            expires = None
+            if kind == _COMPACT_EXPIRES:
+                if len(data) < 5:
+                    break
+                kind = data[0]
+                expires = int.from_bytes(data[1:5], "big")
+                data = data[5:]
+
+            payload = _unpack_payload(kind, data)
+            if payload is None:
+                break
+
+            stale = (
+                cookie_format != "compact"
+                or mac_size != current_mac_size
+                or candidate_id != current_key_id
+                or (key_id is None and len(keys) > 1)
+            )
+            return payload, stale, expires
+
+    return None, False, None
+
+
+def _pack_payload(payload):
+    if payload.isascii() and payload.isdigit() and payload[0] != "0":
+        number = int(payload)
+        return _COMPACT_INT, number.to_bytes((number.bit_length() + 7) // 8, "big")
+
+    try:
+        uuid = UUID(payload)
+    except ValueError:
+        pass
+    else:
+        # only canonical UUIDs come back out the same
+        if str(uuid) == payload:
+            return _COMPACT_UUID, uuid.bytes
+
+    return _COMPACT_STR, payload.encode("utf-8")
+
+
+def _unpack_payload(kind, data):
+    if kind == _COMPACT_INT and data:
+        return str(int.from_bytes(data, "big"))
+    if kind == _COMPACT_UUID and len(data) == 16:
+        return str(UUID(bytes=data))
+    if kind == _COMPACT_STR:
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return None
+    return None
+
+
+def _cookie_key_id(cookie):
+    """Return the key ID embedded in `cookie`, or ``None``."""
+    if "|" not in cookie:
+        parts = _split_compact_cookie(cookie)
+        return None if parts is None else parts[1]
+
+    parts = _split_cookie(cookie)
+    return None if parts is None else parts[2]
+
+
+def _cookie_is_outdated(cookie):
+    """Tell whether `cookie` was signed in a format, or with a digest or key
+    other than the current ones, or without an expiry time while
+    ``REMEMBER_COOKIE_SIGN_EXPIRY`` is set, without verifying it.
+    """
+    current_key_id, keys, cookie_format, mac_size, digest_name, _ = _cookie_settings()
+    if "|" not in cookie:
+        parts = _split_compact_cookie(cookie)
+        if parts is None:
+            return False
+        untimed = (parts[0][0] & _COMPACT_KIND_MASK) != _COMPACT_EXPIRES
+        outdated = cookie_format != "compact" or parts[2] != mac_size
+        key_id = parts[1]
+    else:
+        parts = _split_cookie(cookie)
+        if parts is None:
+            return False
+        untimed = parts[3] is None
+        outdated = cookie_format != "text" or parts[1] != digest_name
+        key_id = parts[2]
+
+    if untimed and _login_config().cookie_sign_expiry:
+        return True
+    return outdated or (len(keys) > 1 and key_id != current_key_id)
+
+
+def _login_config():
+    """Return the config snapshot of the current app, see
+    :meth:`LoginManager.refresh_config`.
+    """
+    login_manager = getattr(current_app, "login_manager", None)
+    if login_manager is None:
+        return _LoginConfig(current_app.config)
+    return login_manager._config()
 
 
 def make_next_param(login_url, current_url):
@@ -143,13 +504,16 @@ def login_remembered():
     """
     This returns ``True`` if the current login is remembered across sessions.
     """
-    config = current_app.config
-    cookie_name = config.get("REMEMBER_COOKIE_NAME", COOKIE_NAME)
+    cookie_name = _login_config().cookie_name
     has_cookie = cookie_name in request.cookies and session.get("_remember") != "clear"
     if has_cookie:
         cookie = request.cookies[cookie_name]
-        user_id = decode_cookie(cookie)
-        return user_id is not None
+        login_manager = getattr(current_app, "login_manager", None)
+        store = None if login_manager is None else login_manager.token_store
+        if store is not None and login_manager._token_owner(cookie)[0] is not None:
+            return True
+        require_expiry = _login_config().cookie_sign_expiry
+        return _verify_cookie(cookie, require_expiry=require_expiry)[0] is not None
     return False
 
 
@@ -181,9 +545,11 @@ def login_user(user, remember=False, duration=None, force=False, fresh=True):
         return False
 
     user_id = getattr(user, current_app.login_manager.id_attribute)()
+    current_app.login_manager.invalidate(user_id)
     session["_user_id"] = user_id
     session["_fresh"] = fresh
-    session["_id"] = current_app.login_manager._session_identifier_generator()
+    session["_id"] = current_app.login_manager._session_identifier()
+    current_app.login_manager._update_snapshot(user_id, user)
 
     if remember:
         session["_remember"] = "set"
@@ -213,19 +579,24 @@ def logout_user():
     user = _get_user()
 
     if "_user_id" in session:
-        session.pop("_user_id")
+        current_app.login_manager.invalidate(session.pop("_user_id"))
 
     if "_fresh" in session:
         session.pop("_fresh")
 
+    if "_user_snapshot" in session:
+        session.pop("_user_snapshot")
+
     if "_id" in session:
         session.pop("_id")
 
-    cookie_name = current_app.config.get("REMEMBER_COOKIE_NAME", COOKIE_NAME)
+    cookie_name = _login_config().cookie_name
     if cookie_name in request.cookies:
         session["_remember"] = "clear"
         if "_remember_seconds" in session:
             session.pop("_remember_seconds")
+        if "_remember_expires" in session:
+            session.pop("_remember_expires")
 
     user_logged_out.send(current_app._get_current_object(), user=user)
 
@@ -239,7 +610,7 @@ def confirm_login():
     are reloaded from a cookie.
     """
     session["_fresh"] = True
-    session["_id"] = current_app.login_manager._session_identifier_generator()
+    session["_id"] = current_app.login_manager._session_identifier()
     user_login_confirmed.send(current_app._get_current_object())
 
 
@@ -269,21 +640,29 @@ def login_required(func):
         <http://www.w3.org/TR/cors/#cross-origin-request-with-preflight-0>`_,
         HTTP ``OPTIONS`` requests are exempt from login checks.
 
+    ``async def`` views are wrapped in an ``async def`` view, which loads the
+    user with :func:`current_user_async`, so async loader callbacks are
+    awaited in the view's event loop.
+
     :param func: The view function to decorate.
     :type func: function
     """
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def decorated_view(*args, **kwargs):
+            if request.method not in EXEMPT_METHODS:
+                user = await current_user_async()
+                if not user.is_authenticated:
+                    return current_app.login_manager.unauthorized()
+            return await func(*args, **kwargs)
+
+        return decorated_view
 
     @wraps(func)
     def decorated_view(*args, **kwargs):
-        if request.method in EXEMPT_METHODS:
-            pass
-        elif not current_user.is_authenticated:
+        if request.method not in EXEMPT_METHODS and not _get_user().is_authenticated:
             return current_app.login_manager.unauthorized()
-
-        # flask 1.x compatibility
-        # current_app.ensure_sync is only available in Flask >= 2.0
-        if callable(getattr(current_app, "ensure_sync", None)):
-            return current_app.ensure_sync(func)(*args, **kwargs)
         return func(*args, **kwargs)
 
     return decorated_view
@@ -313,20 +692,28 @@ def fresh_login_required(func):
     :param func: The view function to decorate.
     :type func: function
     """
+    if inspect.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def decorated_view(*args, **kwargs):
+            if request.method not in EXEMPT_METHODS:
+                user = await current_user_async()
+                if not user.is_authenticated:
+                    return current_app.login_manager.unauthorized()
+                if not login_fresh():
+                    return current_app.login_manager.needs_refresh()
+            return await func(*args, **kwargs)
+
+        return decorated_view
 
     @wraps(func)
     def decorated_view(*args, **kwargs):
-        if request.method in EXEMPT_METHODS:
-            pass
-        elif not current_user.is_authenticated:
-            return current_app.login_manager.unauthorized()
-        elif not login_fresh():
-            return current_app.login_manager.needs_refresh()
-        try:
-            # current_app.ensure_sync available in Flask >= 2.0
-            return current_app.ensure_sync(func)(*args, **kwargs)
-        except AttributeError:  # pragma: no cover
-            return func(*args, **kwargs)
+        if request.method not in EXEMPT_METHODS:
+            if not _get_user().is_authenticated:
+                return current_app.login_manager.unauthorized()
+            if not login_fresh():
+                return current_app.login_manager.needs_refresh()
+        return func(*args, **kwargs)
 
     return decorated_view
 
@@ -360,6 +747,30 @@ def set_login_view(login_view, blueprint=None):
         current_app.login_manager.login_view = login_view
 
 
+async def current_user_async():
+    """
+    Returns the current user, like :data:`current_user`, but awaits
+    ``async def`` :meth:`LoginManager.user_loader` and
+    :meth:`LoginManager.request_loader` callbacks in the running event loop
+    instead of blocking it. Use this from ``async def`` views::
+
+        @app.route("/profile")
+        async def profile():
+            user = await current_user_async()
+            ...
+
+    The user is loaded at most once per request, and is shared with
+    :data:`current_user`.
+    """
+    if has_request_context():
+        if "_login_user" not in g:
+            await current_app.login_manager._load_user_async()
+
+        return g._login_user
+
+    return None
+
+
 def _get_user():
     if has_request_context():
         if "_login_user" not in g:
@@ -371,15 +782,168 @@ def _get_user():
 
 
 def _cookie_digest(payload, key=None):
-    key = _secret_key(key)
+    mac = _keyed_hmac(_secret_key(key)).copy()
+    mac.update(payload.encode("utf-8"))
+    return mac.hexdigest()
+
+
+def _blake2b_digest(payload, key=None):
+    mac = _keyed_blake2b(_secret_key(key)).copy()
+    mac.update(payload.encode("utf-8"))
+    return mac.hexdigest()
 
-    return hmac.new(key, payload.encode("utf-8"), sha512).hexdigest()
+
+def _compact_mac(body, key, mac_size):
+    mac = _keyed_compact_blake2b(key, mac_size).copy()
+    mac.update(body)
+    return mac.digest()
+
+
+# The caches below hold an entry per secret key, of every app sharing the
+# LoginManager, so they are sized for many tenants with a few keys each.
+@lru_cache(maxsize=256)
+def _keyed_blake2b(key):
+    return blake2b(key=_blake2b_key(key), digest_size=32)
+
+
+@lru_cache(maxsize=256)
+def _keyed_compact_blake2b(key, mac_size):
+    # personalized, so it never matches a text cookie digest
+    return blake2b(key=_blake2b_key(key), digest_size=mac_size, person=b"flask-login.c")
+
+
+def _blake2b_key(key):
+    if len(key) > 64:
+        # BLAKE2b keys are limited to 64 bytes
+        key = blake2b(key).digest()
+    return key
+
+
+#: The name of the digest used by cookies that are not tagged with one.
+_LEGACY_DIGEST = "sha512"
+
+#: The digests remember cookies can be signed with, by name. Each takes the
+#: payload and the key, and returns the digest as a URL-safe `str`.
+COOKIE_DIGESTS = {
+    "sha512": _cookie_digest,
+    "blake2b": _blake2b_digest,
+}
+
+
+def _cookie_digests():
+    """Return the name of the digest to sign cookies with, and the digests
+    that are accepted.
+    """
+    login_manager = getattr(current_app, "login_manager", None)
+    digests = COOKIE_DIGESTS if login_manager is None else login_manager.cookie_digests
+    return _login_config().cookie_digest, digests
+
+
+def _key_ring(key=None):
+    """Return ``(current_key_id, keys)``, where `keys` maps key IDs to the
+    current key followed by the fallback keys. If `key` is given, it is the
+    only key.
+    """
+    if key is not None:
+        return _build_key_ring((_secret_key(key),))
+
+    config = current_app.config
+    keys = [config["SECRET_KEY"], *(config.get("SECRET_KEY_FALLBACKS") or ())]
+    return _build_key_ring(tuple(_secret_key(k) for k in keys))
+
+
+@lru_cache(maxsize=256)
+def _build_key_ring(keys):
+    ring = {}
+    for key in keys:
+        ring.setdefault(_key_id(key), key)
+    return next(iter(ring)), ring
+
+
+@lru_cache(maxsize=256)
+def _expiry_key(key):
+    # cookies with an expiry time are signed with a key of their own, so a
+    # cookie without one can never pass for a cookie with one or vice versa
+    return hmac.new(key, b"flask-login.expires", sha256).digest()
+
+
+def _key_id(key):
+    return hmac.new(key, b"flask-login.key-id", sha256).hexdigest()[:8]
+
+
+@lru_cache(maxsize=256)
+def _keyed_hmac(key):
+    # Keying an HMAC hashes the padded key into the inner and outer digest
+    # states. Do that once per key, and copy the keyed object for each cookie.
+    return hmac.new(key, digestmod=sha512)
 
 
 def _create_identifier():
-    h = sha512()
-    h.update(f"{request.remote_addr}|{request.user_agent.string}".encode())
-    return h.hexdigest()
+    name = _login_config().session_fingerprint
+    return _fingerprint(name, _session_fingerprints())
+
+
+def _fingerprint(name, fingerprints):
+    func = fingerprints.get(name)
+    if func is None:
+        raise Exception(
+            f"SESSION_FINGERPRINT must be one of {sorted(fingerprints)},"
+            f" instead got: {name}"
+        )
+
+    # the raw header, request.user_agent would parse it for nothing
+    user_agent = request.environ.get("HTTP_USER_AGENT", "")
+    return _hash_identifier(name, func, request.remote_addr, user_agent)
+
+
+@lru_cache(maxsize=1024)
+def _hash_identifier(name, func, remote_addr, user_agent):
+    digest = func(f"{remote_addr}|{user_agent}".encode())
+    if name == _LEGACY_FINGERPRINT:
+        return digest
+    return f"{name}:{digest}"
+
+
+def _identifier_matches(stored):
+    """Tell whether `stored`, an identifier made by any of the registered
+    fingerprints, matches the current request.
+    """
+    if not isinstance(stored, str):
+        return False
+
+    name, sep, _ = stored.rpartition(":")
+    fingerprints = _session_fingerprints()
+    name = name if sep else _LEGACY_FINGERPRINT
+    if name not in fingerprints:
+        return False
+    return _fingerprint(name, fingerprints) == stored
+
+
+def _sha512_fingerprint(data):
+    return sha512(data).hexdigest()
+
+
+def _blake2b_fingerprint(data):
+    return blake2b(data, digest_size=16).hexdigest()
+
+
+#: The name of the fingerprint used by identifiers that are not tagged with
+#: one.
+_LEGACY_FINGERPRINT = "sha512"
+
+#: The fingerprints the session identifier can be made with, by name. Each
+#: takes the remote address and user agent as `bytes`, and returns a `str`.
+SESSION_FINGERPRINTS = {
+    "sha512": _sha512_fingerprint,
+    "blake2b": _blake2b_fingerprint,
+}
+
+
+def _session_fingerprints():
+    login_manager = getattr(current_app, "login_manager", None)
+    if login_manager is None:
+        return SESSION_FINGERPRINTS
+    return login_manager.session_fingerprints
 
 
 def _user_context_processor():
@@ -1,27 +1,41 @@
+import inspect
+import threading
+import time
 import unittest
+import uuid
 from collections.abc import Hashable
 from contextlib import contextmanager
 from datetime import datetime
 from datetime import timedelta
 from datetime import timezone
+from hashlib import sha512
 from unittest.mock import ANY
 from unittest.mock import Mock
 from unittest.mock import patch
 
 from flask import Blueprint
+from flask import current_app
 from flask import Flask
+from flask import g
 from flask import get_flashed_messages
 from flask import Response
 from flask import session
 from flask.views import MethodView
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.test import Client
 
 from flask_login import AnonymousUserMixin
+from flask_login import BatchScheduler
 from flask_login import confirm_login
+from flask_login import CookieCache
 from flask_login import current_user
+from flask_login import current_user_async
 from flask_login import decode_cookie
 from flask_login import encode_cookie
 from flask_login import FlaskLoginClient
 from flask_login import fresh_login_required
+from flask_login import issue_cookies
+from flask_login import LoaderDeadline
 from flask_login import login_fresh
 from flask_login import login_remembered
 from flask_login import login_required
@@ -30,19 +44,32 @@ from flask_login import login_user
 from flask_login import LoginManager
 from flask_login import logout_user
 from flask_login import make_next_param
+from flask_login import MemoryTokenStore
 from flask_login import session_protected
 from flask_login import set_login_view
+from flask_login import SingleFlight
+from flask_login import SQLiteTokenStore
+from flask_login import TokenStore
 from flask_login import user_accessed
 from flask_login import user_loaded_from_cookie
 from flask_login import user_loaded_from_request
+from flask_login import user_loader_timeout
 from flask_login import user_logged_in
 from flask_login import user_logged_out
 from flask_login import user_login_confirmed
 from flask_login import user_needs_refresh
 from flask_login import user_unauthorized
+from flask_login import UserCache
 from flask_login import UserMixin
+from flask_login import verify_cookies
+from flask_login.utils import _cookie_key_id
+from flask_login.utils import _create_identifier
+from flask_login.utils import _decode_cookie
+from flask_login.utils import _hash_identifier
+from flask_login.utils import _key_ring
 from flask_login.utils import _secret_key
 from flask_login.utils import _user_context_processor
+from flask_login.utils import _verify_cookie
 
 
 @contextmanager
@@ -714,6 +741,40 @@ class LoginTestCase(unittest.TestCase):
         )
         self.assertIn(expected_exception_message, str(cm.exception))
 
+    def test_init_app_with_invalid_duration_raises_exception(self):
+        app = Flask(__name__)
+        app.config["REMEMBER_COOKIE_DURATION"] = "123"
+        with self.assertRaises(Exception) as cm:
+            LoginManager(app)
+
+        self.assertIn("REMEMBER_COOKIE_DURATION", str(cm.exception))
+
+    def test_init_app_with_unknown_digest_raises_exception(self):
+        for name in ("REMEMBER_COOKIE_DIGEST", "SESSION_FINGERPRINT"):
+            app = Flask(__name__)
+            app.config[name] = "md5"
+            with self.assertRaises(Exception) as cm:
+                LoginManager(app)
+
+            self.assertIn(name, str(cm.exception))
+
+    def test_config_snapshot(self):
+        self.app.config["REMEMBER_COOKIE_DURATION"] = 60
+        self.app.config["REMEMBER_COOKIE_REFRESH_THRESHOLD"] = 30
+        with self.app.test_request_context():
+            config = self.login_manager._config()
+            self.assertIs(config, self.login_manager._config())
+            self.assertEqual(timedelta(seconds=60), config.cookie_duration)
+            self.assertEqual(timedelta(seconds=30), config.cookie_refresh_threshold)
+            self.assertEqual("remember", config.cookie_name)
+            with self.assertRaises(AttributeError):
+                config.cookie_name = "other"
+
+            self.app.config["REMEMBER_COOKIE_NAME"] = "other"
+            self.assertEqual("remember", self.login_manager._config().cookie_name)
+            self.login_manager.refresh_config()
+            self.assertEqual("other", self.login_manager._config().cookie_name)
+
     def test_remember_me_no_refresh_every_request(self):
         domain = self.app.config["REMEMBER_COOKIE_DOMAIN"] = "localhost.local"
         path = self.app.config["REMEMBER_COOKIE_PATH"] = "/"
@@ -1044,6 +1105,116 @@ class LoginTestCase(unittest.TestCase):
             # verify no session data has been set
             self.assertFalse(session)
 
+    def test_session_identifier_computed_once_per_request(self):
+        self.app.config["SESSION_PROTECTION"] = "strong"
+        generator = Mock(side_effect=_create_identifier)
+        self.login_manager._session_identifier_generator = generator
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            self.assertEqual(1, generator.call_count)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.assertEqual(2, generator.call_count)
+
+    def test_session_identifier_uses_raw_user_agent(self):
+        environ = {"REMOTE_ADDR": "10.0.0.1", "HTTP_USER_AGENT": "Browser/1.0"}
+        expected = sha512(b"10.0.0.1|Browser/1.0").hexdigest()
+        with self.app.test_request_context(environ_base=environ):
+            with patch("flask.Request.user_agent_class") as user_agent:
+                self.assertEqual(expected, _create_identifier())
+                user_agent.assert_not_called()
+        with self.app.test_request_context(environ_base=environ):
+            hits = _hash_identifier.cache_info().hits
+            self.assertEqual(expected, _create_identifier())
+            self.assertEqual(hits + 1, _hash_identifier.cache_info().hits)
+
+    def test_session_fingerprint(self):
+        self.app.config["SESSION_FINGERPRINT"] = "blake2b"
+        environ = {"REMOTE_ADDR": "10.0.0.1", "HTTP_USER_AGENT": "Browser/1.0"}
+        with self.app.test_request_context(environ_base=environ):
+            ident = _create_identifier()
+            self.assertTrue(ident.startswith("blake2b:"))
+            self.assertEqual(len("blake2b:") + 32, len(ident))
+            self.app.config["SESSION_FINGERPRINT"] = "md5"
+            with self.assertRaises(Exception) as cm:
+                self.login_manager.refresh_config(self.app)
+            self.assertIn("SESSION_FINGERPRINT", str(cm.exception))
+
+    def test_session_fingerprint_rollout(self):
+        self.app.config["SESSION_PROTECTION"] = "strong"
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            with c.session_transaction() as sess:
+                self.assertEqual(128, len(sess["_id"]))
+            self.app.config["SESSION_FINGERPRINT"] = "blake2b"
+            self.login_manager.refresh_config(self.app)
+            with listen_to(session_protected) as listener:
+                self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+                listener.assert_heard_none(self.app)
+            with c.session_transaction() as sess:
+                self.assertTrue(sess["_id"].startswith("blake2b:"))
+            result = c.get("/username", headers=[("User-Agent", "different")])
+            self.assertEqual("Anonymous", result.data.decode("utf-8"))
+
+    def test_session_protection_skips_hashing(self):
+        generator = Mock(side_effect=_create_identifier)
+        self.login_manager._session_identifier_generator = generator
+        with self.app.test_client() as c:
+            # disabled
+            c.get("/username")
+            self.app.config["SESSION_PROTECTION"] = "strong"
+            self.login_manager.refresh_session_protection(self.app)
+            # anonymous
+            c.get("/username")
+            generator.assert_not_called()
+            with self.app.app_context():
+                counters = self.login_manager.session_protection_counters()
+            self.assertEqual(0, counters["disabled"])
+            self.assertEqual(1, counters["anonymous"])
+
+    def test_session_protection_counters(self):
+        self.app.config["SESSION_PROTECTION"] = "strong"
+        with self.app.test_client() as c:
+            c.get("/login-notch-permanent")
+            c.get("/username")
+            c.get("/username", headers=[("User-Agent", "different")])
+            self._delete_session(c)
+            c.get("/login-notch")
+            c.get("/username", headers=[("User-Agent", "different")])
+        counters = self.login_manager.session_protection_counters(self.app)
+        self.assertEqual(1, counters["matched"])
+        self.assertEqual(1, counters["marked_unfresh"])
+        self.assertEqual(1, counters["cleared"])
+
+    def test_session_protection_counters_are_thread_safe(self):
+        self.app.config["SESSION_PROTECTION"] = None
+
+        def check():
+            with self.app.test_request_context():
+                for _ in range(1000):
+                    self.login_manager._session_protection_failed()
+
+        threads = [threading.Thread(target=check) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        counters = self.login_manager.session_protection_counters(self.app)
+        self.assertEqual(8000, counters["disabled"])
+
+    def test_session_protection_mode_is_resolved_once(self):
+        self.app.config["SESSION_PROTECTION"] = "strong"
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            c.get("/username")
+            self.app.config["SESSION_PROTECTION"] = None
+            result = c.get("/username", headers=[("User-Agent", "different")])
+            self.assertEqual("Anonymous", result.data.decode("utf-8"))
+            self.login_manager.refresh_session_protection(self.app)
+            c.get("/login-notch")
+            result = c.get("/username", headers=[("User-Agent", "different")])
+            self.assertEqual("Notch", result.data.decode("utf-8"))
+
     #
     # Lazy Access User
     #
@@ -1336,6 +1507,29 @@ class CookieEncodingTestCase(unittest.TestCase):
             self.assertIsNone(decode_cookie("Foo|BAD_BASH", key=key))
             self.assertIsNone(decode_cookie("no bar", key=key))
 
+    def test_cookie_encoding_with_key_without_app(self):
+        key = "deterministic"
+        cookie = encode_cookie("1", key=key)
+        self.assertEqual("1", decode_cookie(cookie, key=key))
+        self.assertIsNone(decode_cookie(cookie, key="other"))
+
+        app = Flask(__name__)
+        app.config["SECRET_KEY"] = "not-used"
+        with app.test_request_context():
+            self.assertEqual(cookie, encode_cookie("1", key=key))
+
+    def test_cookie_encoding_follows_secret_key(self):
+        app = Flask(__name__)
+        app.config["SECRET_KEY"] = "deterministic"
+
+        with app.test_request_context():
+            cookie = encode_cookie("1")
+            app.config["SECRET_KEY"] = "rotated"
+            self.assertIsNone(decode_cookie(cookie))
+            self.assertEqual("1", decode_cookie(encode_cookie("1")))
+            app.config["SECRET_KEY"] = "deterministic"
+            self.assertEqual("1", decode_cookie(cookie))
+
 
 class SecretKeyTestCase(unittest.TestCase):
     def setUp(self):
@@ -1609,6 +1803,7 @@ class CustomTestClientTestCase(unittest.TestCase):
 
         # Enabled with mode: basic
         self.app.config["SESSION_PROTECTION"] = "basic"
+        self.login_manager.refresh_session_protection(self.app)
         with self.app.test_client(user=notch, fresh_login=False) as c:
             username = c.get("/username")
             self.assertEqual("Notch", username.data.decode("utf-8"))
@@ -1623,6 +1818,7 @@ class CustomTestClientTestCase(unittest.TestCase):
 
         # Enabled with mode: strong
         self.app.config["SESSION_PROTECTION"] = "strong"
+        self.login_manager.refresh_session_protection(self.app)
         with self.app.test_client(user=notch, fresh_login=False) as c:
             username = c.get("/username")
             self.assertEqual("Anonymous", username.data.decode("utf-8"))
@@ -1634,3 +1830,1417 @@ class CustomTestClientTestCase(unittest.TestCase):
             self.assertEqual("Anonymous", username.data.decode("utf-8"))
             is_fresh = c.get("/is-fresh")
             self.assertEqual("False", is_fresh.data.decode("utf-8"))
+
+
+class AppTestCase(unittest.TestCase):
+    """Sets up an app with a `LoginManager`, a `user_loader` mock and the
+    routes shared by the tests of single features. Subclasses add what their
+    feature needs after calling ``super().setUp()``.
+    """
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config["SECRET_KEY"] = "deterministic"
+        self.app.config["SESSION_PROTECTION"] = None
+        self.login_manager = LoginManager()
+        self.login_manager.init_app(self.app)
+        self.load_user = Mock(side_effect=lambda user_id: USERS.get(int(user_id)))
+        self.login_manager.user_loader(self.load_user)
+
+        @self.app.route("/username")
+        def username():
+            if current_user.is_authenticated:
+                return current_user.name
+            return "Anonymous"
+
+        @self.app.route("/login-notch")
+        def login_notch():
+            return str(login_user(notch))
+
+        @self.app.route("/login-notch-remember")
+        def login_notch_remember():
+            return str(login_user(notch, remember=True))
+
+        @self.app.route("/logout")
+        def logout():
+            return str(logout_user())
+
+
+class UserCacheTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.user_cache = UserCache(maxsize=2, ttl=60)
+
+    def test_user_loader_called_once(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.load_user.assert_called_once_with(1)
+
+    def test_logout_invalidates(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            c.get("/username")
+            self.assertIn(1, self.login_manager.user_cache)
+            c.get("/logout")
+            self.assertNotIn(1, self.login_manager.user_cache)
+
+    def test_invalidate(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            c.get("/username")
+            self.login_manager.invalidate("1")
+            c.get("/username")
+            self.assertEqual(self.load_user.call_count, 2)
+
+    def test_ttl_expiry(self):
+        now = [0.0]
+        cache = UserCache(ttl=timedelta(seconds=10), timer=lambda: now[0])
+        cache.set(1, notch)
+        self.assertIs(cache.get("1"), notch)
+        now[0] = 10.0
+        self.assertIsNone(cache.get(1))
+        self.assertIs(cache.peek(1), notch)
+
+    def test_lru_eviction(self):
+        cache = self.login_manager.user_cache
+        cache.set(1, notch)
+        cache.set(2, steve)
+        cache.get(1)
+        cache.set(3, creeper)
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertIn(3, cache)
+
+    def test_negative_cache(self):
+        self.login_manager.user_cache = UserCache(negative_maxsize=10)
+        with self.app.test_request_context():
+            cookie = encode_cookie("9000")
+        with self.app.test_client() as c:
+            c.set_cookie("remember_token", cookie)
+            with c.session_transaction() as sess:
+                sess["_user_id"] = "9000"
+            self.assertEqual("Anonymous", c.get("/username").data.decode("utf-8"))
+            self.assertEqual("Anonymous", c.get("/username").data.decode("utf-8"))
+            self.load_user.assert_called_once_with("9000")
+
+    def test_negative_cache_ttl_and_login(self):
+        now = [0.0]
+        cache = UserCache(negative_maxsize=1, negative_ttl=5, timer=lambda: now[0])
+        cache.set(9000, None)
+        self.assertIsNone(cache.get(9000, "missing"))
+        cache.set(9001, None)
+        self.assertEqual(cache.get(9000, "missing"), "missing")
+        now[0] = 5.0
+        self.assertEqual(cache.get(9001, "missing"), "missing")
+        cache.set(1, None)
+        cache.set(1, notch)
+        self.assertIs(cache.get(1, "missing"), notch)
+
+
+class AsyncLoaderTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+
+        @self.login_manager.user_loader
+        async def load_user(user_id):
+            return USERS.get(int(user_id))
+
+        @self.login_manager.request_loader
+        async def load_user_from_request(request):
+            user_id = request.args.get("user_id")
+            return USERS.get(int(user_id)) if user_id else None
+
+        @self.app.route("/async-username")
+        async def async_username():
+            user = await current_user_async()
+            if user.is_authenticated:
+                return user.name
+            return "Anonymous"
+
+    def test_async_user_loader_from_sync_view(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+
+    def test_current_user_async(self):
+        with self.app.test_client() as c:
+            result = c.get("/async-username")
+            self.assertEqual("Anonymous", result.data.decode("utf-8"))
+            c.get("/login-notch")
+            result = c.get("/async-username")
+            self.assertEqual("Notch", result.data.decode("utf-8"))
+
+    def test_current_user_async_request_loader(self):
+        with self.app.test_client() as c:
+            result = c.get("/async-username?user_id=2")
+            self.assertEqual("Steve", result.data.decode("utf-8"))
+
+    def test_current_user_async_shares_current_user(self):
+        import asyncio
+
+        with self.app.test_request_context():
+            session["_user_id"] = "1"
+            self.assertIs(asyncio.run(current_user_async()), notch)
+            self.assertEqual(current_user.name, "Notch")
+
+    def test_load_user_async_uses_cache(self):
+        import asyncio
+
+        self.login_manager.user_cache = UserCache()
+        with self.app.test_request_context():
+            self.assertIs(asyncio.run(self.login_manager.load_user_async("2")), steve)
+            self.assertIn("2", self.login_manager.user_cache)
+
+    def test_current_user_async_outside_request(self):
+        import asyncio
+
+        self.assertIsNone(asyncio.run(current_user_async()))
+
+    def test_login_required_async_view(self):
+        @self.app.route("/protected")
+        @login_required
+        async def protected():
+            return (await current_user_async()).name
+
+        self.assertTrue(inspect.iscoroutinefunction(protected))
+        with self.app.test_client() as c:
+            self.assertEqual(401, c.get("/protected").status_code)
+            c.get("/login-notch")
+            # the user is awaited, never loaded through the sync path
+            with patch.object(self.login_manager, "_load_user") as load_user:
+                result = c.get("/protected")
+                load_user.assert_not_called()
+            self.assertEqual("Notch", result.data.decode("utf-8"))
+
+    def test_fresh_login_required_async_view(self):
+        @self.app.route("/fresh")
+        @fresh_login_required
+        async def fresh():
+            return "Fresh"
+
+        self.assertTrue(inspect.iscoroutinefunction(fresh))
+        with self.app.test_client() as c:
+            self.assertEqual(401, c.get("/fresh").status_code)
+            c.get("/login-notch")
+            self.assertEqual("Fresh", c.get("/fresh").data.decode("utf-8"))
+            with c.session_transaction() as sess:
+                sess["_fresh"] = False
+            self.assertEqual(401, c.get("/fresh").status_code)
+
+
+class SingleFlightTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.single_flight = SingleFlight()
+        self.release = threading.Event()
+        self.calls = []
+
+        @self.login_manager.user_loader
+        def load_user(user_id):
+            self.calls.append(user_id)
+            self.release.wait(5)
+            return USERS.get(int(user_id))
+
+    def _load_concurrently(self, count):
+        results = []
+
+        def load():
+            with self.app.test_request_context():
+                results.append(self.login_manager._load_user_by_id("1"))
+
+        threads = [threading.Thread(target=load) for _ in range(count)]
+        for thread in threads:
+            thread.start()
+        while not self.calls:
+            time.sleep(0.001)
+        time.sleep(0.05)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_loads_are_coalesced(self):
+        results = self._load_concurrently(5)
+        self.assertEqual(self.calls, ["1"])
+        self.assertEqual(results, [notch] * 5)
+
+    def test_timeout_calls_loader(self):
+        self.login_manager.single_flight = SingleFlight(timeout=0.01)
+        results = self._load_concurrently(2)
+        self.assertEqual(self.calls, ["1", "1"])
+        self.assertEqual(results, [notch] * 2)
+
+    def test_exception_is_shared(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do("1", lambda: 1 / 0)
+        self.assertEqual(flight.do("1", lambda: "ok"), "ok")
+
+
+class BatchLoaderTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.load_users = Mock(
+            side_effect=lambda ids: {int(i): USERS.get(int(i)) for i in ids}
+        )
+
+    def test_falls_back_to_user_loader(self):
+        with self.app.app_context():
+            users = self.login_manager.load_users(["1", "2", "9000"])
+        self.assertEqual(users, {"1": notch, "2": steve, "9000": None})
+        self.assertEqual(self.load_user.call_count, 3)
+
+    def test_single_batch_call(self):
+        self.login_manager.user_batch_loader(self.load_users)
+        self.assertIs(self.login_manager.user_batch_callback, self.load_users)
+        with self.app.app_context():
+            users = self.login_manager.load_users(["1", 2, "2", "9000"])
+        self.assertEqual(users, {"1": notch, 2: steve, "2": steve, "9000": None})
+        self.load_users.assert_called_once_with(["1", "2", "9000"])
+        self.load_user.assert_not_called()
+
+    def test_batch_uses_cache(self):
+        self.login_manager.user_batch_loader(self.load_users)
+        self.login_manager.user_cache = UserCache(negative_maxsize=10)
+        self.login_manager.user_cache.set("1", notch)
+        with self.app.app_context():
+            self.login_manager.load_users(["1", "2", "9000"])
+            self.load_users.assert_called_once_with(["2", "9000"])
+            self.assertIs(self.login_manager._load_user_by_id("2"), steve)
+            users = self.login_manager.load_users(["1", "2", "9000"])
+        self.assertEqual(users, {"1": notch, "2": steve, "9000": None})
+        self.assertEqual(self.load_users.call_count, 1)
+        self.load_user.assert_not_called()
+
+
+class BatchSchedulerTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.batch_scheduler = BatchScheduler(window=0.5, max_batch=3)
+        self.batches = []
+
+        @self.login_manager.user_loader
+        def load_user(user_id):
+            raise AssertionError("user_loader should not be called")
+
+        @self.login_manager.user_batch_loader
+        def load_users(user_ids):
+            self.batches.append(sorted(user_ids))
+            return {user_id: USERS.get(int(user_id)) for user_id in user_ids}
+
+    def test_concurrent_loads_are_batched(self):
+        results = {}
+
+        def load(user_id):
+            with self.app.app_context():
+                results[user_id] = self.login_manager._load_user_by_id(user_id)
+
+        threads = [threading.Thread(target=load, args=(i,)) for i in ("1", "2", "3")]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # max_batch was reached, so the batch was dispatched before the window
+        self.assertLess(time.monotonic() - start, 0.5)
+        self.assertEqual(self.batches, [["1", "2", "3"]])
+        self.assertEqual(results, {"1": notch, "2": steve, "3": creeper})
+
+    def test_window_dispatches_partial_batch(self):
+        self.login_manager.batch_scheduler = BatchScheduler(window=0.001)
+        with self.app.app_context():
+            self.assertIsNone(self.login_manager._load_user_by_id("9000"))
+        self.assertEqual(self.batches, [["9000"]])
+
+    def test_exception_is_shared(self):
+        scheduler = BatchScheduler(window=0)
+        with self.assertRaises(ZeroDivisionError):
+            scheduler.load("1", lambda keys: 1 / 0)
+        self.assertEqual(scheduler.load("1", lambda keys: {"1": "ok"}), "ok")
+
+    def test_groups_are_batched_apart(self):
+        scheduler = BatchScheduler(window=0.2)
+        results = {}
+
+        def load(group):
+            results[group] = scheduler.load("1", lambda keys: {"1": group}, group)
+
+        threads = [threading.Thread(target=load, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, {"a": "a", "b": "b"})
+
+
+class LazyUserTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.lazy_user = True
+
+    def test_authenticated_without_loading(self):
+        with self.app.test_request_context():
+            session["_user_id"] = "1"
+            self.assertTrue(current_user.is_authenticated)
+            self.assertFalse(current_user.is_anonymous)
+            self.assertEqual(current_user.get_id(), "1")
+            self.load_user.assert_not_called()
+
+    def test_attribute_access_loads_once(self):
+        with self.app.test_request_context():
+            session["_user_id"] = "1"
+            self.assertEqual(current_user.name, "Notch")
+            self.assertTrue(current_user.is_active)
+            self.assertEqual(current_user, notch)
+            self.assertEqual(notch, current_user)
+            self.load_user.assert_called_once_with("1")
+
+    def test_missing_user_becomes_anonymous(self):
+        with self.app.test_request_context():
+            session["_user_id"] = "9000"
+            self.assertTrue(current_user.is_authenticated)
+            self.assertFalse(current_user.is_active)
+            self.assertFalse(current_user.is_authenticated)
+            self.assertTrue(current_user.is_anonymous)
+            self.assertIsNone(current_user.get_id())
+
+    def test_str_loads_user(self):
+        with self.app.test_request_context():
+            session["_user_id"] = "1"
+            self.assertEqual(str(notch), str(current_user))
+            self.load_user.assert_called_once_with("1")
+
+    def test_login_user_is_not_lazy(self):
+        with self.app.test_request_context():
+            login_user(steve)
+            self.assertIs(current_user._get_current_object(), steve)
+
+
+class UserSnapshotTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["USER_SNAPSHOT_MAX_AGE"] = 60
+
+        @self.login_manager.snapshot_dumper
+        def dump_user(user):
+            return {"name": user.name}
+
+        @self.login_manager.snapshot_loader
+        def load_snapshot(user_id, data):
+            return User(data["name"], user_id)
+
+    def test_snapshot_skips_user_loader(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.load_user.assert_not_called()
+
+    def test_snapshot_expires(self):
+        with self.app.test_client() as c:
+            with patch("flask_login.login_manager.time") as mock_time:
+                mock_time.time.return_value = 1000.0
+                c.get("/login-notch")
+                mock_time.time.return_value = 1061.0
+                self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+                self.load_user.assert_called_once_with(1)
+                # the snapshot was refreshed by the user_loader call
+                c.get("/username")
+                self.load_user.assert_called_once_with(1)
+
+    def test_snapshot_generation(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            self.login_manager.snapshot_generation += 1
+            c.get("/username")
+            self.load_user.assert_called_once_with(1)
+
+    def test_inactive_snapshot_is_ignored(self):
+        with self.app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess["_user_id"] = 3
+                sess["_user_snapshot"] = [1, 3, False, 0, int(time.time()), {}]
+            self.assertEqual("Anonymous", c.get("/username").data.decode("utf-8"))
+            self.load_user.assert_called_once_with(3)
+
+    def test_logout_removes_snapshot(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            c.get("/logout")
+            with c.session_transaction() as sess:
+                self.assertNotIn("_user_snapshot", sess)
+
+    def test_lazy_user_refreshes_snapshot(self):
+        self.login_manager.lazy_user = True
+        with self.app.test_client() as c:
+            with patch("flask_login.login_manager.time") as mock_time:
+                mock_time.time.return_value = 1000.0
+                c.get("/login-notch")
+                mock_time.time.return_value = 1061.0
+                for _ in range(3):
+                    self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+                self.load_user.assert_called_once_with(1)
+
+    def test_lazy_user_loaded_after_logout(self):
+        self.login_manager.lazy_user = True
+        names = []
+
+        def on_logout(app, user):
+            names.append(user.name)
+
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            with c.session_transaction() as sess:
+                sess.pop("_user_snapshot")
+            with user_logged_out.connected_to(on_logout):
+                self.assertEqual(200, c.get("/logout").status_code)
+            self.assertEqual(["Notch"], names)
+            with c.session_transaction() as sess:
+                self.assertNotIn("_user_snapshot", sess)
+
+
+class StaleWhileRevalidateTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = [0.0]
+        self.login_manager.user_cache = UserCache(
+            ttl=10, stale_ttl=20, timer=lambda: self.now[0]
+        )
+        self.loaded = threading.Event()
+        self.names = {"1": "Notch"}
+
+        @self.login_manager.user_loader
+        def load_user(user_id):
+            self.loaded.set()
+            return User(self.names[user_id], user_id)
+
+    def _load(self):
+        with self.app.app_context():
+            return self.login_manager._load_user_by_id("1")
+
+    def test_stale_user_is_refreshed_in_background(self):
+        self._load()
+        self.names["1"] = "Jeb"
+        self.loaded.clear()
+        self.now[0] = 15.0
+        self.assertEqual(self._load().name, "Notch")
+        self.assertTrue(self.loaded.wait(5))
+        self.login_manager.user_cache._executor.shutdown(wait=True)
+        self.assertEqual(self._load().name, "Jeb")
+
+    def test_past_stale_ttl_blocks(self):
+        self._load()
+        self.names["1"] = "Jeb"
+        self.now[0] = 30.0
+        self.assertEqual(self._load().name, "Jeb")
+        self.assertIsNone(self.login_manager.user_cache._executor)
+
+    def test_stale_without_refresh_is_expired(self):
+        cache = self.login_manager.user_cache
+        cache.set("1", notch)
+        self.now[0] = 15.0
+        self.assertIsNone(cache.get("1"))
+        self.assertIs(cache.get("1", refresh=lambda: steve), notch)
+        cache._executor.shutdown(wait=True)
+        self.assertIs(cache.get("1"), steve)
+
+    def test_invalidate_discards_refresh(self):
+        cache = self.login_manager.user_cache
+        cache.set("1", notch)
+        self.now[0] = 15.0
+        release = threading.Event()
+
+        def refresh():
+            release.wait(5)
+            return steve
+
+        cache.get("1", refresh=refresh)
+        cache.invalidate("1")
+        release.set()
+        cache._executor.shutdown(wait=True)
+        self.assertIsNone(cache.get("1"))
+
+
+class LoaderDeadlineTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.loader_deadline = LoaderDeadline(timeout=0.05)
+        self.release = threading.Event()
+        self.slow = True
+
+        @self.login_manager.user_loader
+        def load_user(user_id):
+            if self.slow:
+                self.release.wait(5)
+            return USERS.get(int(user_id))
+
+        @self.login_manager.request_loader
+        def load_user_from_request(request):
+            user_id = request.args.get("user_id")
+            if user_id is None:
+                return None
+            return load_user(user_id)
+
+    def tearDown(self):
+        self.release.set()
+
+    def _get_username(self, c):
+        with c.session_transaction() as sess:
+            sess["_user_id"] = "1"
+        return c.get("/username")
+
+    def test_fast_loader(self):
+        self.slow = False
+        with self.app.test_client() as c:
+            self.assertEqual("Notch", self._get_username(c).data.decode("utf-8"))
+
+    def test_timeout_is_anonymous(self):
+        with self.app.test_client() as c:
+            with listen_to(user_loader_timeout) as listener:
+                result = self._get_username(c)
+                listener.assert_heard_one(self.app, user_id="1")
+            self.assertEqual("Anonymous", result.data.decode("utf-8"))
+
+    def test_request_loader_timeout(self):
+        with self.app.test_client() as c:
+            with listen_to(user_loader_timeout) as listener:
+                result = c.get("/username?user_id=2")
+                listener.assert_heard_one(self.app, user_id=None)
+            self.assertEqual("Anonymous", result.data.decode("utf-8"))
+
+    def test_timeout_abort(self):
+        self.login_manager.loader_deadline = LoaderDeadline(0.05, fallback="abort")
+        with self.app.test_client() as c:
+            self.assertEqual(self._get_username(c).status_code, 503)
+
+    def test_timeout_serves_stale_user(self):
+        now = [0.0]
+        self.login_manager.user_cache = UserCache(ttl=10, timer=lambda: now[0])
+        self.login_manager.user_cache.set("1", notch)
+        now[0] = 20.0
+        self.login_manager.loader_deadline = LoaderDeadline(0.05, fallback="stale")
+        with self.app.test_client() as c:
+            self.assertEqual("Notch", self._get_username(c).data.decode("utf-8"))
+
+    def test_async_loader_timeout(self):
+        import asyncio
+
+        @self.login_manager.user_loader
+        async def load_user(user_id):
+            await asyncio.sleep(5)
+
+        with self.app.test_request_context():
+            session["_user_id"] = "1"
+            self.assertTrue(asyncio.run(current_user_async()).is_anonymous)
+
+    def test_load_users_timeout(self):
+        with self.app.app_context():
+            self.assertEqual({"1": None}, self.login_manager.load_users(["1"]))
+
+    def test_load_users_batch_timeout(self):
+        @self.login_manager.user_batch_loader
+        def load_users(user_ids):
+            self.release.wait(5)
+            return {user_id: USERS.get(int(user_id)) for user_id in user_ids}
+
+        self.login_manager.user_cache = UserCache()
+        with self.app.app_context():
+            with listen_to(user_loader_timeout) as listener:
+                users = self.login_manager.load_users(["1", "2"])
+                self.assertEqual(2, len(listener.heard))
+            self.assertEqual({"1": None, "2": None}, users)
+            self.assertEqual(0, len(self.login_manager.user_cache))
+
+    def test_load_user_async_timeout(self):
+        import asyncio
+
+        @self.login_manager.user_loader
+        async def load_user(user_id):
+            await asyncio.sleep(5)
+
+        with self.app.app_context():
+            self.assertIsNone(asyncio.run(self.login_manager.load_user_async("1")))
+
+    def test_sync_loader_timeout_in_async_path(self):
+        import asyncio
+
+        with self.app.app_context():
+            with listen_to(user_loader_timeout) as listener:
+                self.assertIsNone(asyncio.run(self.login_manager.load_user_async("1")))
+                listener.assert_heard_one(self.app, user_id="1")
+        with self.app.test_request_context("/?user_id=2"):
+            self.assertTrue(asyncio.run(current_user_async()).is_anonymous)
+
+        self.slow = False
+        with self.app.app_context():
+            user = asyncio.run(self.login_manager.load_user_async("1"))
+            self.assertEqual(notch, user)
+
+    def test_invalid_fallback(self):
+        with self.assertRaises(ValueError):
+            LoaderDeadline(1, fallback="retry")
+
+
+class KeyRotationTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["SECRET_KEY"] = "old"
+
+    def _rotate(self):
+        self.app.config["SECRET_KEY"] = "new"
+        self.app.config["SECRET_KEY_FALLBACKS"] = ["old"]
+
+    def test_without_fallbacks_has_no_key_id(self):
+        with self.app.test_request_context():
+            self.assertIsNone(_cookie_key_id(encode_cookie("1")))
+
+    def test_fallback_key_is_accepted(self):
+        with self.app.test_request_context():
+            old_cookie = encode_cookie("1")
+            self._rotate()
+            self.assertEqual("1", decode_cookie(old_cookie))
+            new_cookie = encode_cookie("1")
+            self.assertIsNotNone(_cookie_key_id(new_cookie))
+            self.assertEqual("1", decode_cookie(new_cookie))
+            self.assertIsNone(decode_cookie(new_cookie, key="old"))
+
+    def test_key_id_selects_key(self):
+        with self.app.test_request_context():
+            self._rotate()
+            cookie = encode_cookie("1")
+            payload, digest = cookie.split("|")
+            key_id = _cookie_key_id(cookie)
+            digest_mock = Mock(return_value=digest.split(".")[1])
+            digests = self.login_manager.cookie_digests
+            with patch.dict(digests, sha512=digest_mock):
+                self.assertEqual("1", decode_cookie(cookie))
+                digest_mock.assert_called_once()
+            forged = f"{payload}|{'0' * len(key_id)}.{digest.split('.')[1]}"
+            self.assertIsNone(decode_cookie(forged))
+
+    def test_old_cookie_is_reissued(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            old_cookie = c.get_cookie("remember_token").value
+            self._rotate()
+            # the session keeps the user logged in, the cookie is replaced
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            new_cookie = c.get_cookie("remember_token").value
+            self.assertNotEqual(old_cookie, new_cookie)
+            with self.app.test_request_context():
+                self.assertEqual(_cookie_key_id(new_cookie), _key_ring()[0])
+
+    def test_restored_from_old_cookie_is_reissued(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            with c.session_transaction() as sess:
+                sess.clear()
+            self._rotate()
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            with self.app.test_request_context():
+                new_cookie = c.get_cookie("remember_token").value
+                self.assertEqual(_cookie_key_id(new_cookie), _key_ring()[0])
+
+    def test_old_cookie_of_other_user_is_not_reissued(self):
+        @self.app.route("/login-steve")
+        def login_steve():
+            return str(login_user(steve))
+
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            old_cookie = c.get_cookie("remember_token").value
+            self._rotate()
+            c.get("/login-steve")
+            self.assertEqual("Steve", c.get("/username").data.decode("utf-8"))
+            self.assertEqual(old_cookie, c.get_cookie("remember_token").value)
+
+
+class CookieDigestTestCase(AppTestCase):
+    def test_blake2b_cookie(self):
+        self.app.config["REMEMBER_COOKIE_DIGEST"] = "blake2b"
+        with self.app.test_request_context():
+            cookie = encode_cookie("1")
+            name, key_id, digest = cookie.split("|")[1].split(".")
+            self.assertEqual("blake2b", name)
+            self.assertEqual(_key_ring()[0], key_id)
+            self.assertEqual(64, len(digest))
+            self.assertEqual("1", decode_cookie(cookie))
+            self.assertIsNone(decode_cookie(cookie.replace("1|", "2|")))
+
+    def test_old_digest_is_accepted(self):
+        with self.app.test_request_context():
+            legacy = encode_cookie("1")
+            self.app.config["REMEMBER_COOKIE_DIGEST"] = "blake2b"
+            self.login_manager.refresh_config(self.app)
+            self.assertEqual("1", decode_cookie(legacy))
+            self.assertNotEqual(legacy, encode_cookie("1"))
+
+    def test_unknown_digest(self):
+        with self.app.test_request_context():
+            cookie = f"1|md5.{_key_ring()[0]}.abc"
+            self.assertIsNone(decode_cookie(cookie))
+            self.app.config["REMEMBER_COOKIE_DIGEST"] = "md5"
+            with self.assertRaises(Exception) as cm:
+                self.login_manager.refresh_config(self.app)
+            self.assertIn("REMEMBER_COOKIE_DIGEST", str(cm.exception))
+
+    def test_custom_digest(self):
+        self.login_manager.cookie_digests["plain"] = lambda payload, key: "x"
+        self.app.config["REMEMBER_COOKIE_DIGEST"] = "plain"
+        with self.app.test_request_context():
+            cookie = encode_cookie("1")
+            self.assertTrue(cookie.startswith("1|plain."))
+            self.assertEqual("1", decode_cookie(cookie))
+
+    def test_old_digest_cookie_is_reissued(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            self.app.config["REMEMBER_COOKIE_DIGEST"] = "blake2b"
+            self.login_manager.refresh_config(self.app)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            cookie = c.get_cookie("remember_token").value
+            self.assertTrue(cookie.split("|")[1].startswith("blake2b."))
+
+    def test_forged_outdated_cookie_is_not_reissued(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch")
+            c.set_cookie("remember_token", "1|blake2b.deadbeef.garbage")
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            cookie = c.get_cookie("remember_token").value
+            self.assertEqual("1|blake2b.deadbeef.garbage", cookie)
+
+
+class CompactCookieTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["REMEMBER_COOKIE_FORMAT"] = "compact"
+
+    def test_round_trip(self):
+        payloads = ["1", "0", "123456789012345678901234567890", "007", "-1"]
+        payloads += ["notch", "ünïcode", "", str(uuid.uuid4())]
+        payloads += [str(uuid.uuid4()).upper()]
+        with self.app.test_request_context():
+            for payload in payloads:
+                cookie = encode_cookie(payload)
+                self.assertNotIn("|", cookie)
+                self.assertEqual(payload, decode_cookie(cookie))
+
+    def test_compact_ids(self):
+        with self.app.test_request_context():
+            # header, one byte of ID and a 16 byte MAC
+            self.assertEqual(24, len(encode_cookie("1")))
+            # header, 16 bytes of UUID and a 16 byte MAC
+            self.assertEqual(44, len(encode_cookie(str(uuid.uuid4()))))
+
+    def test_mac_size(self):
+        with self.app.test_request_context():
+            self.app.config["REMEMBER_COOKIE_MAC_SIZE"] = 8
+            self.login_manager.refresh_config(self.app)
+            short = encode_cookie("1")
+            self.app.config["REMEMBER_COOKIE_MAC_SIZE"] = 32
+            self.login_manager.refresh_config(self.app)
+            long = encode_cookie("1")
+            self.assertEqual((14, 46), (len(short), len(long)))
+            self.assertEqual("1", decode_cookie(long))
+            # MACs shorter than configured are refused
+            self.assertIsNone(decode_cookie(short))
+
+    def test_tampered_cookie(self):
+        with self.app.test_request_context():
+            cookie = encode_cookie("1")
+            tampered = ("B" if cookie[0] != "B" else "C") + cookie[1:]
+            self.assertIsNone(decode_cookie(tampered))
+            self.assertIsNone(decode_cookie(cookie, key="other"))
+            self.assertIsNone(decode_cookie(cookie[:4]))
+            self.assertIsNone(decode_cookie("no bar"))
+            self.assertIsNone(decode_cookie(""))
+
+    def test_key_rotation(self):
+        with self.app.test_request_context():
+            old_cookie = encode_cookie("1")
+            self.app.config["SECRET_KEY"] = "new"
+            self.app.config["SECRET_KEY_FALLBACKS"] = ["deterministic"]
+            self.assertEqual("1", decode_cookie(old_cookie))
+            new_cookie = encode_cookie("1")
+            self.assertEqual(_key_ring()[0], _cookie_key_id(new_cookie))
+            self.assertEqual("1", decode_cookie(new_cookie))
+
+    def test_formats_are_interchangeable(self):
+        with self.app.test_request_context():
+            compact = encode_cookie("1")
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = "text"
+            self.login_manager.refresh_config(self.app)
+            text = encode_cookie("1")
+            self.assertNotEqual(compact, text)
+            self.assertEqual("1", decode_cookie(compact))
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = "compact"
+            self.login_manager.refresh_config(self.app)
+            self.assertEqual("1", decode_cookie(text))
+
+    def test_invalid_config(self):
+        with self.app.test_request_context():
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = "binary"
+            with self.assertRaises(Exception) as cm:
+                encode_cookie("1")
+            self.assertIn("REMEMBER_COOKIE_FORMAT", str(cm.exception))
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = "compact"
+            self.app.config["REMEMBER_COOKIE_MAC_SIZE"] = 4
+            with self.assertRaises(Exception) as cm:
+                encode_cookie("1")
+            self.assertIn("REMEMBER_COOKIE_MAC_SIZE", str(cm.exception))
+
+    def test_text_cookie_is_reissued(self):
+        self.app.config["REMEMBER_COOKIE_FORMAT"] = "text"
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = "compact"
+            self.login_manager.refresh_config(self.app)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            cookie = c.get_cookie("remember_token").value
+            self.assertNotIn("|", cookie)
+            with c.session_transaction() as sess:
+                sess.clear()
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+
+
+class CookieCacheTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.cookie_cache = CookieCache(maxsize=2)
+
+    def _verify_mock(self):
+        return patch("flask_login.utils._decode_cookie", wraps=_decode_cookie)
+
+    def test_verified_cookie_is_cached(self):
+        with self.app.test_request_context():
+            cookie = encode_cookie("1")
+            with self._verify_mock() as verify:
+                self.assertEqual("1", decode_cookie(cookie))
+                self.assertEqual("1", decode_cookie(cookie))
+                self.assertEqual(1, verify.call_count)
+            self.assertEqual(1, len(self.login_manager.cookie_cache))
+
+    def test_invalid_cookie_is_not_cached(self):
+        with self.app.test_request_context():
+            with self._verify_mock() as verify:
+                self.assertIsNone(decode_cookie("1|bad"))
+                self.assertIsNone(decode_cookie("1|bad"))
+                self.assertEqual(2, verify.call_count)
+            self.assertEqual(0, len(self.login_manager.cookie_cache))
+
+    def test_bounded(self):
+        with self.app.test_request_context():
+            for user_id in "123":
+                decode_cookie(encode_cookie(user_id))
+            self.assertEqual(2, len(self.login_manager.cookie_cache))
+
+    def test_flushed_on_key_change(self):
+        with self.app.test_request_context():
+            cookie = encode_cookie("1")
+            self.assertEqual("1", decode_cookie(cookie))
+            self.app.config["SECRET_KEY"] = "other"
+            self.assertIsNone(decode_cookie(cookie))
+            self.assertEqual(0, len(self.login_manager.cookie_cache))
+
+    def test_explicit_key_bypasses_cache(self):
+        with self.app.test_request_context():
+            cookie = encode_cookie("1", key="explicit")
+            self.assertEqual("1", decode_cookie(cookie, key="explicit"))
+            self.assertEqual(0, len(self.login_manager.cookie_cache))
+
+    def test_stale_flag_is_kept(self):
+        with self.app.test_request_context():
+            cookie = encode_cookie("1")
+            self.app.config["REMEMBER_COOKIE_DIGEST"] = "blake2b"
+            self.login_manager.refresh_config(self.app)
+            self.assertEqual(("1", True), _verify_cookie(cookie))
+            # served from the cache, still re-issued
+            self.assertEqual(("1", True), _verify_cookie(cookie))
+
+
+class CookieExpiryTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["REMEMBER_COOKIE_SIGN_EXPIRY"] = True
+
+    def test_expiry_is_signed(self):
+        expires = datetime.now(timezone.utc) + timedelta(hours=1)
+        for cookie_format in ("text", "compact"):
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = cookie_format
+            with self.app.test_request_context():
+                cookie = encode_cookie("1", expires=expires)
+                self.assertEqual("1", decode_cookie(cookie))
+
+    def test_expired_cookie_is_refused(self):
+        expires = datetime.now(timezone.utc) - timedelta(seconds=1)
+        for cookie_format in ("text", "compact"):
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = cookie_format
+            with self.app.test_request_context():
+                self.assertIsNone(decode_cookie(encode_cookie("1", expires=expires)))
+
+    def test_tampered_expiry_is_refused(self):
+        expires = datetime.now(timezone.utc) + timedelta(hours=1)
+        with self.app.test_request_context():
+            cookie = encode_cookie("1", expires=expires)
+            payload, signature = cookie.split("|")
+            name, key_id, timestamp, digest = signature.split(".")
+            forged = f"{payload}|{name}.{key_id}.{int(timestamp) + 1}.{digest}"
+            self.assertIsNone(decode_cookie(forged))
+            # nor does stripping the expiry make the cookie valid
+            self.assertIsNone(decode_cookie(f"{payload}|{digest}"))
+
+    def test_untimed_cookie_is_refused(self):
+        for cookie_format in ("text", "compact"):
+            self.app.config["REMEMBER_COOKIE_FORMAT"] = cookie_format
+            self.login_manager.refresh_config(self.app)
+            with self.app.test_request_context():
+                cookie = encode_cookie("1")
+            with self.app.test_client() as c:
+                c.set_cookie("remember_token", cookie)
+                self.assertEqual("Anonymous", c.get("/username").data.decode())
+            self.load_user.assert_not_called()
+
+    def test_untimed_cookie_is_reissued(self):
+        self.app.config["REMEMBER_COOKIE_SIGN_EXPIRY"] = False
+        self.login_manager.refresh_config(self.app)
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            self.app.config["REMEMBER_COOKIE_SIGN_EXPIRY"] = True
+            self.login_manager.refresh_config(self.app)
+            # the session still holds the user, the cookie gets an expiry time
+            self.assertEqual("Notch", c.get("/username").data.decode())
+            cookie = c.get_cookie("remember_token").value
+            self.assertEqual(4, len(cookie.split("|")[1].split(".")))
+
+    def test_cached_cookie_expires(self):
+        self.login_manager.cookie_cache = CookieCache()
+        with self.app.test_request_context():
+            cookie = encode_cookie("1", expires=datetime.now(timezone.utc))
+            with patch("flask_login.utils.time.time", return_value=0):
+                self.assertEqual("1", decode_cookie(cookie))
+            self.assertIsNone(decode_cookie(cookie))
+
+    def test_expired_cookie_skips_loader(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            cookie = c.get_cookie("remember_token").value
+            self.assertEqual(4, len(cookie.split("|")[1].split(".")))
+            with c.session_transaction() as sess:
+                sess.clear()
+            self.load_user.reset_mock()
+            future = time.time() + 366 * 24 * 3600
+            with patch("flask_login.utils.time.time", return_value=future):
+                self.assertEqual("Anonymous", c.get("/username").data.decode())
+            self.load_user.assert_not_called()
+            self.assertEqual("Notch", c.get("/username").data.decode())
+
+
+class TokenStoreTests:
+    def make_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.make_store()
+
+    def test_set_and_get(self):
+        self.store.set("token", 1, time.time() + 60)
+        self.assertEqual("1", self.store.get("token"))
+        self.assertIsNone(self.store.get("other"))
+
+    def test_expired_token(self):
+        self.store.set("token", 1, time.time() - 1)
+        self.assertIsNone(self.store.get("token"))
+        self.assertEqual(1, len(self.store))
+        self.store.sweep()
+        self.assertEqual(0, len(self.store))
+
+    def test_revoke(self):
+        self.store.set("phone", 1, time.time() + 60)
+        self.store.set("laptop", 1, time.time() + 60)
+        self.store.revoke("phone")
+        self.assertIsNone(self.store.get("phone"))
+        self.assertEqual("1", self.store.get("laptop"))
+
+    def test_revoke_user(self):
+        self.store.set("phone", 1, time.time() + 60)
+        self.store.set("laptop", 1, time.time() + 60)
+        self.store.set("other", 2, time.time() + 60)
+        self.store.revoke_user(1)
+        self.assertIsNone(self.store.get("phone"))
+        self.assertIsNone(self.store.get("laptop"))
+        self.assertEqual("2", self.store.get("other"))
+
+    def test_replace(self):
+        self.store.set("token", 1, time.time() + 60)
+        self.store.set("token", 2, time.time() + 60)
+        self.assertEqual("2", self.store.get("token"))
+        self.store.revoke_user(1)
+        self.assertEqual("2", self.store.get("token"))
+
+    def test_lookup(self):
+        self.store.set("token", 1, time.time() + 60, "abc")
+        self.store.set("plain", 2, time.time() + 60)
+        self.assertEqual(("1", "abc"), self.store.lookup("token"))
+        self.assertEqual(("2", None), self.store.lookup("plain"))
+        self.assertIsNone(self.store.lookup("other"))
+
+
+class TokenStoreTestCase(unittest.TestCase):
+    def test_incomplete_store(self):
+        class IncompleteStore(TokenStore):
+            def _get(self, token_hash, now):
+                return None
+
+        with self.assertRaises(TypeError):
+            IncompleteStore()
+
+
+class MemoryTokenStoreTestCase(TokenStoreTests, unittest.TestCase):
+    def make_store(self):
+        return MemoryTokenStore()
+
+
+class SQLiteTokenStoreTestCase(TokenStoreTests, unittest.TestCase):
+    def make_store(self):
+        store = SQLiteTokenStore(":memory:", sweep_interval=None)
+        self.addCleanup(store.close)
+        return store
+
+    def test_tokens_are_hashed(self):
+        self.store.set("token", 1, time.time() + 60)
+        rows = self.store._connection.execute("SELECT * FROM remember_tokens")
+        self.assertNotIn("token", [row[0] for row in rows])
+
+    def test_sweep_interval(self):
+        store = SQLiteTokenStore(":memory:", sweep_interval=0)
+        self.addCleanup(store.close)
+        store.set("old", 1, time.time() - 1)
+        store.set("new", 1, time.time() + 60)
+        self.assertEqual(1, len(store))
+
+    def test_invalid_table(self):
+        with self.assertRaises(ValueError):
+            SQLiteTokenStore(":memory:", table="tokens; DROP TABLE users")
+
+
+class RememberTokenTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.login_manager.token_store = MemoryTokenStore()
+
+        @self.app.route("/is-remembered")
+        def is_remembered():
+            return str(login_remembered())
+
+    def _restart_session(self, c):
+        with c.session_transaction() as sess:
+            sess.clear()
+
+    def test_cookie_holds_token(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            token = c.get_cookie("remember_token").value
+            self.assertEqual("1", self.login_manager.token_store.get(token))
+            with self.app.test_request_context():
+                self.assertIsNone(decode_cookie(token))
+            self._restart_session(c)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.assertEqual("True", c.get("/is-remembered").data.decode("utf-8"))
+
+    def test_revoked_token(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            token = c.get_cookie("remember_token").value
+            self.login_manager.token_store.revoke(token)
+            self._restart_session(c)
+            self.assertEqual("Anonymous", c.get("/username").data.decode("utf-8"))
+
+    def test_logout_revokes_token(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            token = c.get_cookie("remember_token").value
+            c.get("/logout")
+            self.assertIsNone(self.login_manager.token_store.get(token))
+
+    def test_refresh_keeps_token(self):
+        self.app.config["REMEMBER_COOKIE_REFRESH_EACH_REQUEST"] = True
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            token = c.get_cookie("remember_token").value
+            c.get("/username")
+            self.assertEqual(token, c.get_cookie("remember_token").value)
+            self.assertEqual(1, len(self.login_manager.token_store))
+
+    def test_signed_cookie_is_replaced(self):
+        self.login_manager.token_store = None
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            signed = c.get_cookie("remember_token").value
+            self.login_manager.token_store = MemoryTokenStore()
+            self._restart_session(c)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            token = c.get_cookie("remember_token").value
+            self.assertNotEqual(signed, token)
+            self.assertEqual("1", self.login_manager.token_store.get(token))
+
+    def test_token_survives_key_rotation(self):
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            token = c.get_cookie("remember_token").value
+            self.app.config["SECRET_KEY"] = "new"
+            self.app.config["SECRET_KEY_FALLBACKS"] = ["deterministic"]
+            self._restart_session(c)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.assertEqual(token, c.get_cookie("remember_token").value)
+            with self.app.test_request_context():
+                key_id = _key_ring()[0]
+            self.assertEqual(
+                ("1", key_id), self.login_manager.token_store.lookup(token)
+            )
+
+            # once the old key is dropped, so are tokens not re-bound to the new one
+            self.app.config["SECRET_KEY_FALLBACKS"] = []
+            self._restart_session(c)
+            self.assertEqual("Notch", c.get("/username").data.decode("utf-8"))
+            self.app.config["SECRET_KEY"] = "newer"
+            self._restart_session(c)
+            self.assertEqual("Anonymous", c.get("/username").data.decode("utf-8"))
+
+
+class BulkCookieTestCase(AppTestCase):
+    def test_issue_and_verify(self):
+        payloads = [str(i) for i in range(25)]
+        with self.app.test_request_context():
+            issued = list(issue_cookies(payloads, chunk_size=4, max_workers=2))
+            self.assertEqual(payloads, [payload for payload, _ in issued])
+            for payload, cookie in issued:
+                self.assertEqual(encode_cookie(payload), cookie)
+
+            cookies = [cookie for _, cookie in issued] + ["1|bad"]
+            verified = list(verify_cookies(cookies, chunk_size=4, max_workers=2))
+            self.assertEqual(payloads + [None], [payload for _, payload in verified])
+
+    def test_in_process(self):
+        self.app.config["REMEMBER_COOKIE_FORMAT"] = "compact"
+        with self.app.test_request_context():
+            expires = datetime.now(timezone.utc) - timedelta(seconds=1)
+            ((_, cookie),) = issue_cookies(["1"], expires=expires, max_workers=0)
+            self.assertEqual(
+                [(cookie, None)], list(verify_cookies([cookie], max_workers=0))
+            )
+
+    def test_input_is_consumed_lazily(self):
+        consumed = []
+
+        def payloads():
+            for i in range(100):
+                consumed.append(i)
+                yield str(i)
+
+        with self.app.test_request_context():
+            results = issue_cookies(payloads(), chunk_size=10, max_workers=0)
+            next(results)
+            self.assertEqual(10, len(consumed))
+
+    def test_cli(self):
+        runner = self.app.test_cli_runner()
+        result = runner.invoke(
+            args=["login", "issue-cookies", "--workers", "0", "-"], input="1\n2\n"
+        )
+        self.assertEqual(0, result.exit_code, result.output)
+        cookies = result.stdout.splitlines()
+        self.assertEqual(2, len(cookies))
+
+        lines = "\n".join(cookies + ["2|bad"]) + "\n"
+        args = ["login", "verify-cookies", "--workers", "0", "-"]
+        result = runner.invoke(args=args, input=lines)
+        self.assertEqual(0, result.exit_code, result.output)
+        self.assertEqual(
+            ["valid\t1", "valid\t2", "invalid"], result.stdout.splitlines()
+        )
+        self.assertIn("2 valid, 1 invalid", result.stderr)
+
+
+class RememberCookieRenewalTestCase(AppTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["REMEMBER_COOKIE_REFRESH_EACH_REQUEST"] = True
+        self.app.config["REMEMBER_COOKIE_DURATION"] = timedelta(days=10)
+        self.app.config["REMEMBER_COOKIE_REFRESH_THRESHOLD"] = timedelta(days=5)
+
+    def test_renewed_below_threshold(self):
+        with patch("flask_login.login_manager.datetime") as mock_dt:
+            now = datetime.now(timezone.utc)
+            mock_dt.now = Mock(return_value=now)
+            with self.app.test_client() as c:
+                c.get("/login-notch-remember")
+                response = c.get("/username")
+                self.assertNotIn("Set-Cookie", response.headers)
+
+                mock_dt.now.return_value = now + timedelta(days=6)
+                response = c.get("/username")
+                self.assertIn("remember_token=", response.headers["Set-Cookie"])
+                expires = c.get_cookie("remember_token").expires
+                expected = now.replace(microsecond=0) + timedelta(days=16)
+                self.assertEqual(expected, expires)
+
+    def test_without_threshold(self):
+        self.app.config["REMEMBER_COOKIE_REFRESH_THRESHOLD"] = None
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            response = c.get("/username")
+            self.assertIn("remember_token=", response.headers["Set-Cookie"])
+            with c.session_transaction() as sess:
+                self.assertNotIn("_remember_expires", sess)
+
+    def test_encoded_cookie_is_memoized(self):
+        self.app.config["REMEMBER_COOKIE_REFRESH_THRESHOLD"] = None
+        with self.app.test_client() as c:
+            c.get("/login-notch-remember")
+            with patch("flask_login.login_manager._encode_cookie") as encode:
+                c.get("/username")
+                encode.assert_not_called()
+            # a new digest means a new cookie
+            self.app.config["REMEMBER_COOKIE_DIGEST"] = "blake2b"
+            self.login_manager.refresh_config(self.app)
+            with self.app.test_request_context():
+                expected = encode_cookie("1")
+            c.get("/username")
+            self.assertEqual(expected, c.get_cookie("remember_token").value)
+
+
+class MultiAppTestCase(unittest.TestCase):
+    def setUp(self):
+        self.login_manager = LoginManager()
+        self.login_manager.user_cache = UserCache()
+        self.login_manager.cookie_cache = CookieCache()
+        self.load_user = Mock(side_effect=self._load_user)
+        self.login_manager.user_loader(self.load_user)
+        self.login_manager.login_view = "login"
+        self.apps = [self._make_app("alice"), self._make_app("bob")]
+
+    def _load_user(self, user_id):
+        name = current_app.config["TENANT"]
+        return User(name, int(user_id))
+
+    def _make_app(self, tenant):
+        app = Flask(__name__)
+        app.config["SECRET_KEY"] = f"secret-{tenant}"
+        app.config["TENANT"] = tenant
+        self.login_manager.init_app(app)
+
+        @app.route("/login")
+        def login():
+            return str(login_user(User(tenant, 1), remember=True))
+
+        @app.route("/username")
+        def username():
+            if current_user.is_authenticated:
+                return current_user.name
+            return "Anonymous"
+
+        @app.route("/logout")
+        def logout():
+            return str(logout_user())
+
+        @app.route("/secret")
+        @login_required
+        def secret():
+            return "secret"
+
+        return app
+
+    def test_users_are_cached_per_app(self):
+        clients = [app.test_client() for app in self.apps]
+        for client in clients:
+            client.get("/login")
+        for _ in range(2):
+            names = [c.get("/username").data.decode("utf-8") for c in clients]
+            self.assertEqual(["alice", "bob"], names)
+        self.assertEqual(2, len(self.login_manager.user_cache))
+        self.assertEqual(2, self.load_user.call_count)
+
+    def test_invalidate_without_app_context(self):
+        clients = [app.test_client() for app in self.apps]
+        for client in clients:
+            client.get("/login")
+            client.get("/username")
+        self.login_manager.invalidate("1")
+        self.assertEqual(0, len(self.login_manager.user_cache))
+        with self.apps[0].app_context():
+            self.login_manager.invalidate("1")
+
+    def test_cookies_are_cached_per_app(self):
+        app_a, app_b = self.apps
+        with app_a.test_request_context():
+            cookie = encode_cookie("1")
+            self.assertEqual("1", decode_cookie(cookie))
+        with app_b.test_request_context():
+            # signed with another key, and not served from the cache
+            self.assertIsNone(decode_cookie(cookie))
+            decode_cookie(encode_cookie("1"))
+        with app_a.test_request_context():
+            with patch("flask_login.utils._decode_cookie") as verify:
+                self.assertEqual("1", decode_cookie(cookie))
+                verify.assert_not_called()
+        self.assertEqual(2, len(self.login_manager.cookie_cache))
+
+    def test_remember_tokens_per_app(self):
+        self.login_manager.token_store = MemoryTokenStore()
+        app_a, app_b = self.apps
+        app = DispatcherMiddleware(app_a, {"/b": app_b})
+        c = Client(app)
+        c.get("/login")
+        c.delete_cookie("session")
+        self.assertEqual("alice", c.get("/username").data.decode("utf-8"))
+        # the cookie path of A covers B, which must not accept the token
+        self.assertEqual("Anonymous", c.get("/b/username").data.decode("utf-8"))
+        c.get("/b/logout")
+        self.assertEqual(1, len(self.login_manager.token_store))
+
+    def test_login_view_url_per_app(self):
+        app_a, app_b = self.apps
+        app_b.config["APPLICATION_ROOT"] = "/bob"
+        for _ in range(2):
+            result = app_a.test_client().get("/secret")
+            self.assertEqual("/login?next=%2Fsecret", result.location)
+        result = app_b.test_client().get("/secret", base_url="http://localhost/bob")
+        self.assertEqual("/bob/login?next=%2Fbob%2Fsecret", result.location)
+
+    def test_login_view_url_per_blueprint(self):
+        app = self.apps[0]
+        for name in ("a", "b"):
+            blueprint = Blueprint(name, __name__, url_prefix=f"/{name}")
+            blueprint.add_url_rule("/login", "login", lambda: "login")
+            blueprint.add_url_rule("/p", "p", login_required(lambda: "p"))
+            app.register_blueprint(blueprint)
+        self.login_manager.blueprint_login_views = {"a": ".login", "b": ".login"}
+
+        client = app.test_client()
+        self.assertEqual("/a/login?next=%2Fa%2Fp", client.get("/a/p").location)
+        self.assertEqual("/b/login?next=%2Fb%2Fp", client.get("/b/p").location)
+
+    def test_login_view_url_with_url_defaults(self):
+        app = Flask(__name__)
+        app.config["SECRET_KEY"] = "secret"
+        self.login_manager.init_app(app)
+        self.login_manager.login_view = "login"
+
+        @app.url_defaults
+        def add_lang(endpoint, values):
+            values.setdefault("lang", g.lang)
+
+        @app.url_value_preprocessor
+        def pull_lang(endpoint, values):
+            g.lang = values.pop("lang")
+
+        app.add_url_rule("/<lang>/login", "login", lambda: "login")
+        app.add_url_rule("/<lang>/page", "page", login_required(lambda: "page"))
+
+        client = app.test_client()
+        self.assertEqual("/en/login?next=%2Fen%2Fpage", client.get("/en/page").location)
+        self.assertEqual("/fr/login?next=%2Ffr%2Fpage", client.get("/fr/page").location)